@@ -8,23 +8,48 @@ Last Edited: 28/10/2023
 
 Components:
     - get_recorder: Returns a cv2 video writer object.
+    - export_tracking_model: Exports the human-tracking model to a TensorRT or OpenVINO FP16 model.
+    - load_tracking_model: Loads the fastest available human-tracking model, reusing it across streams.
     - predict_pose: Predicts the pose of a person in a video frame.
     - has_valid_pose: Checks whether the pose is valid.
     - predict_action: Predicts the action of a person in a video frame.
+    - predict_actions: Predicts the actions for a batch of sequences in a single call.
+    - render_hud_patch: Renders a box of the heads-up display.
+    - blit_hud_patch: Copies a box of the heads-up display onto the video frame.
     - draw_text: Draws the text on the video frame.
     - draw_action_results: Draws the action results on the video frame.
+    - get_tracking_result: Converts the tracker output of a video frame into a tracking result.
     - track_person: Tracks the person in the video frame.
     - draw_track_result: Draws the tracking result on the video frame.
+    - draw_overlay: Draws the tracking result, action results and text on the video frame in a single pass.
+    - pose_inference: Performs pose estimation on the video frame without tracking.
+    - tracking_pose_inference: Performs human tracking and pose estimation on the video frame.
     - non_tracking_inference: Performs inference on the video frame without tracking.
     - tracking_inference: Performs inference on the video frame with tracking.
+    - non_tracking_inference_batch: Performs inference on a batch of video frames without tracking.
+    - process_video_threads: Runs the frames of a video source through a reader, inference and writer pipeline.
 """
+import os
+import queue
+import threading
+import functools
 import numpy as np
 import cv2
-import math
+import torch
 from ultralytics import YOLO
 from pose_detector import PoseDetector
 from utils import *
 
+# The codec of the recorded videos
+RECORDER_FOURCC = cv2.VideoWriter_fourcc(*RECORD_FOURCC)
+
+# The last (fps, patch) drawn by draw_text
+_last_fps_patch = (None, None)
+# The last (action, probability in thousandths, patch) drawn by draw_action_results
+_last_action_patch = (None, None, None)
+# The last ((fps, action, probability in thousandths), patch) drawn by draw_overlay
+_last_hud_patch = (None, None)
+
 class ActionDetectorResult:
     """
     A class used to represent the result of the action detector.
@@ -81,6 +106,60 @@ class TrackingResult:
         """
         return f"X: {self.x}, Y: {self.y}, W: {self.w}, H: {self.h}, ID: {self.id}"
 
+class FrameBatcher:
+    """
+    A class used to queue video frames so that they can be processed as a single batch.
+
+    Attributes:
+        batch_size (int): The number of frames in a full batch.
+        __frames (list): The queued video frames.
+    """
+    def __init__(self, batch_size: int = BATCH_SIZE):
+        """
+        The constructor for the FrameBatcher class.
+
+        Parameters:
+            batch_size (int): The number of frames in a full batch.
+        """
+        self.batch_size = batch_size
+        self.__frames = []
+
+    def __len__(self) -> int:
+        """
+        Returns the number of queued frames.
+
+        Returns:
+            int: The number of queued frames.
+        """
+        return len(self.__frames)
+
+    def add(self, frame) -> list | None:
+        """
+        Queues a video frame and returns the batch once it is full, the remaining frames are returned by flush.
+
+        Parameters:
+            frame (numpy.ndarray): The video frame.
+
+        Returns:
+            list | None: The batch of video frames if it is ready to be processed.
+        """
+        self.__frames.append(frame)
+
+        if len(self.__frames) >= self.batch_size:
+            return self.flush()
+        return None
+
+    def flush(self) -> list:
+        """
+        Returns the queued video frames and empties the queue.
+
+        Returns:
+            list: The queued video frames in the order they were added.
+        """
+        frames = self.__frames
+        self.__frames = []
+        return frames
+
 def get_recorder(filename: str, width: int, height: int):
     """
     Returns a cv2 video writer object.
@@ -97,63 +176,158 @@ def get_recorder(filename: str, width: int, height: int):
     if filename is None:
         raise ValueError("Filename cannot be None if record is True")
 
-    fourcc = cv2.VideoWriter_fourcc(*'XVID')
+    # VideoWriter picks the container from the extension, so make sure there is one
+    filename = ensure_video_extension(filename)
+
     out = cv2.VideoWriter(
-        get_recording_folder() + '/' + filename, 
-        fourcc, 
+        os.path.join(get_recording_folder(), filename), 
+        RECORDER_FOURCC, 
         fps=VIDEO_FPS, 
         frameSize=(width, int(height))
         )
 
     return out
 
-def predict_pose(frame, detector: PoseDetector) -> tuple[any, list]:
+def export_tracking_model(format: str = "engine") -> str:
+    """
+    Exports the human-tracking model with FP16 weights, to a TensorRT engine for CUDA GPUs or to an OpenVINO model 
+    for CPUs. Only needs to be run once, the TensorRT engine on the machine that will run the application 
+    as it is specific to its GPU.
+
+    Parameters:
+        format (str): The format to export to, "engine" for TensorRT or "openvino" for OpenVINO.
+
+    Returns:
+        str: The path of the exported model.
+    """
+    return YOLO(OBJECT_TRACKING_MODEL_PATH).export(format=format, half=True, imgsz=640)
+
+def load_tracking_model() -> YOLO:
+    """
+    Returns the human-tracking model. The model is only loaded once and reused by every stream, 
+    with its tracker state cleared so that each stream starts tracking from scratch.
+
+    Returns:
+        YOLO: The YOLO model.
+    """
+    model = _load_tracking_model()
+
+    # Replace the trackers in place, removing them would register the tracking callbacks again on the next call to track
+    if model.predictor is not None and hasattr(model.predictor, 'trackers'):
+        model.predictor.trackers = [type(t)(args=t.args, frame_rate=30) for t in model.predictor.trackers]
+    return model
+
+@functools.lru_cache(maxsize=1)
+def _load_tracking_model() -> YOLO:
+    """
+    Loads the human-tracking model. The TensorRT FP16 engine is used if it has been exported 
+    and a CUDA GPU is available, then the OpenVINO FP16 model if it has been exported and there is no CUDA GPU, 
+    otherwise the PyTorch model is used.
+
+    Returns:
+        YOLO: The YOLO model.
+    """
+    if torch.cuda.is_available():
+        if os.path.exists(OBJECT_TRACKING_ENGINE_PATH):
+            return YOLO(OBJECT_TRACKING_ENGINE_PATH, task="detect")
+    elif os.path.exists(OBJECT_TRACKING_OPENVINO_PATH):
+        return YOLO(OBJECT_TRACKING_OPENVINO_PATH, task="detect")
+    return YOLO(OBJECT_TRACKING_MODEL_PATH)
+
+def predict_pose(frame, detector: PoseDetector, max_size: int | None = None) -> tuple[any, np.ndarray]:
     """
     Predicts the pose of a person in a video frame. 
 
     Parameters:
         frame (numpy.ndarray): The video frame.
         detector (PoseDetector): The pose detector.
+        max_size (int | None): The maximum size of the longer side of the frame passed to the pose model, None to keep the original size.
 
     Returns:
-        tuple[any, list]: The keypoints and the sequence of keypoints.
+        tuple[any, np.ndarray]: The keypoints and the sequence of keypoints, oldest first.
     """
-    result, _ = detector.findPose(frame)
+    # A tracked crop can be shrunk to the ~256 pixel pose model input before the colour conversion, whole frames are 
+    # kept at full size as MediaPipe crops the person out of them. The landmarks are normalised, so they are still 
+    # drawn in the right place on the original frame.
+    result, _ = detector.findPose(frame, maxSize=max_size)
 
-    # extract keypoints
-    keypoints = detector.extract_keypoints(result)
-    detector.sequence.append(keypoints)
-    detector.sequence = detector.sequence[-SEQUENCE_LENGTH:]
+    # extract keypoints straight into the ring buffer of the detector
+    keypoints = detector.push_keypoints(result)
+    sequence = detector.get_sequence()
 
-    return keypoints, detector.sequence
+    return keypoints, sequence
 
-def has_valid_pose(keypoints, sequence: list) -> bool:
+def has_valid_pose(keypoints, sequence: np.ndarray) -> bool:
     """
     Checks whether the pose is valid.
 
     Parameters:
-        keypoints (any): The keypoints.
-        sequence (list): The sequence of keypoints.
+        keypoints (np.ndarray): The keypoints.
+        sequence (np.ndarray): The sequence of keypoints.
 
     Returns:
         bool: Whether the pose is valid.
     """
-    return sum(keypoints) != 0 and len(sequence) == SEQUENCE_LENGTH
+    return keypoints.any() and len(sequence) == SEQUENCE_LENGTH
 
-def predict_action(detector: PoseDetector, sequence: list) -> tuple[str, float]:
+def predict_action(detector: PoseDetector, sequence: np.ndarray) -> tuple[str, float]:
     """
     Predicts the action of a person in a video frame.
 
     Parameters:
         detector (PoseDetector): The pose detector.
-        sequence (list): The sequence of keypoints.
+        sequence (np.ndarray): The sequence of keypoints.
 
     Returns:
         tuple[str, float]: The predicted action and the probability of the predicted action.
     """
-    res = detector.new_model.predict(np.expand_dims(sequence, axis=0))[0]
-    class_idx = int(np.argmax(res)) 
-    return ACTIONS[class_idx], res[class_idx]
+    res = detector.predict_sequence(sequence)
+    class_idx = res.argmax()
+    return ACTIONS[class_idx], float(res[class_idx])
+
+def predict_actions(detector: PoseDetector, sequences: list) -> list[tuple[str, float]]:
+    """
+    Predicts the actions for a batch of sequences with a single forward pass of the action model.
+
+    Parameters:
+        detector (PoseDetector): The pose detector.
+        sequences (list): The sequences of keypoints, one for each prediction.
+
+    Returns:
+        list[tuple[str, float]]: The predicted action and its probability for each sequence, in the same order.
+    """
+    # Stack into a single (B, SEQUENCE_LENGTH, K) array so the model runs one batched call
+    res = detector.predict_sequences(np.stack(sequences))
+    class_idx = res.argmax(axis=1)
+    return [(ACTIONS[idx], float(probs[idx])) for idx, probs in zip(class_idx, res)]
+
+def render_hud_patch(height: int, lines: list[tuple[str, tuple[int, int]]]):
+    """
+    Renders the lines of text onto a filled box of the heads-up display, which is drawn at the top left of the video frame.
+
+    Parameters:
+        height (int): The height of the box.
+        lines (list[tuple[str, tuple[int, int]]]): The text and its position within the box for each line.
+
+    Returns:
+        numpy.ndarray: The rendered box.
+    """
+    patch = np.full((height, 400, 3), (245, 50, 16), dtype=np.uint8)
+    for text, position in lines:
+        cv2.putText(patch, text, position, cv2.FONT_HERSHEY_PLAIN, 2, (255, 255, 255), 2)
+    return patch
+
+def blit_hud_patch(frame, patch):
+    """
+    Copies a rendered box of the heads-up display onto the top left of the video frame.
+
+    Parameters:
+        frame (numpy.ndarray): The video frame.
+        patch (numpy.ndarray): The rendered box.
+    """
+    # Clip the box in case the frame is smaller than it
+    h, w = min(patch.shape[0], frame.shape[0]), min(patch.shape[1], frame.shape[1])
+    frame[:h, :w] = patch[:h, :w]
 
 def draw_text(frame, fps: int, height: int):
     """
@@ -164,11 +338,13 @@ def draw_text(frame, fps: int, height: int):
         fps (int): The FPS of the video.
         height (int): The height of the video.
     """
-    # FPS text
-    cv2.rectangle(frame, (0, 0), (400, 50), (245, 50, 16), -1)
-    cv2.putText(frame, 
-                'FPS: {}'.format(fps), 
-                 (20, 30), cv2.FONT_HERSHEY_PLAIN, 2, (255, 255, 255), 2)
+    global _last_fps_patch
+
+    # FPS text, only rendered again when the FPS changes
+    if fps != _last_fps_patch[0]:
+        _last_fps_patch = (fps, render_hud_patch(50, [('FPS: {}'.format(fps), (20, 30))]))
+    blit_hud_patch(frame, _last_fps_patch[1])
+
     # Quit Notification text
     cv2.putText(frame, "Press 'Q' to Exit", (10, int(height) - 10), cv2.FONT_HERSHEY_PLAIN, 1, (255, 255, 255), 1)
 
@@ -181,40 +357,65 @@ def draw_action_results(frame, action: str, probability: float):
         action (str): The predicted action.
         probability (float): The probability of the predicted action.
     """
-    cv2.rectangle(frame, (0, 0), (400, 130), (245, 50, 16), -1)
-    cv2.putText(frame, 'Action: {}'.format(action), (20, 70), cv2.FONT_HERSHEY_PLAIN, 2, (255, 255, 255), 2)
-    cv2.putText(frame, 
-                'Probability: {}'.format(math.floor(probability * 1000) / 1000), (20, 110), 
-                cv2.FONT_HERSHEY_PLAIN, 2, (255, 255, 255), 2)
+    global _last_action_patch
 
-def track_person(frame, model: YOLO) -> TrackingResult | None:
+    # Only render the results again when the displayed values change
+    rounded_probability = int(probability * 1000)
+    if (action, rounded_probability) != _last_action_patch[:2]:
+        patch = render_hud_patch(130, [(f"Action: {action}", (20, 70)), 
+                                       (f"Probability: {rounded_probability / 1000:.3f}", (20, 110))])
+        _last_action_patch = (action, rounded_probability, patch)
+    blit_hud_patch(frame, _last_action_patch[2])
+
+def get_tracking_result(frame, boxes) -> TrackingResult | None:
     """
-    Tracks the person in the video frame.
+    Converts the first tracked box of a video frame into a tracking result.
 
     Parameters:
         frame (numpy.ndarray): The video frame.
-        model (YOLO): The YOLO model.
+        boxes (ultralytics.engine.results.Boxes): The boxes returned by the tracker for the video frame.
 
     Returns:
         TrackingResult | None: The tracking result if there is any.
     """
-    track_results = model.track(frame, persist=True, show=False, classes = 0)
-    track_results = model.predict(frame)
-    box_data = track_results[0].boxes.xywh
+    # The tracker has not locked on to anyone yet
+    if boxes.id is None:
+        return None
 
-    if len(box_data) > 0:
-        x, y, w, h, id = box_data[0][0], box_data[0][1], box_data[0][2], box_data[0][3], track_results[0].boxes.data[0][4]
-        
-        x = int(x - w/2)
-        y = int(y - h/2)
-        w = int(w)
-        h = int(h)
+    if len(boxes) > 0:
+        # Copy the first row (x1, y1, x2, y2, id, conf, cls) to the host in a single transfer
+        x1, y1, x2, y2, id = boxes.data[0, :5].cpu().numpy()
 
+        # Clamp the box to the frame, as rounding can place it partly outside
+        x1, y1 = max(0, int(x1)), max(0, int(y1))
+        x2, y2 = min(frame.shape[1], int(x2)), min(frame.shape[0], int(y2))
+        x, y, w, h = x1, y1, x2 - x1, y2 - y1
+
+        # Skip pose estimation on crops too small to hold a usable pose
+        if w <= 0 or h <= 0 or w * h < MIN_ROI_AREA:
+            return None
+
+        # Keep the region of interest as a view of the frame, no copy is needed
         roi = frame[y:y+h, x:x+w]
         return TrackingResult(x, y, w, h, int(id), roi)
     else:
         return None
 
+def track_person(frame, model: YOLO) -> TrackingResult | None:
+    """
+    Tracks the person in the video frame.
+
+    Parameters:
+        frame (numpy.ndarray): The video frame.
+        model (YOLO): The YOLO model.
+
+    Returns:
+        TrackingResult | None: The tracking result if there is any.
+    """
+    # A single tracker pass returns both the boxes and the track IDs
+    track_results = model.track(frame, persist=True, show=False, classes=0, verbose=False, save=False)
+    return get_tracking_result(frame, track_results[0].boxes)
+
 def draw_track_result(frame, results: TrackingResult):
     """
     Draws the tracking result on the video frame.
@@ -227,6 +428,78 @@ def draw_track_result(frame, results: TrackingResult):
     cv2.putText(frame, 'ID: {}'.format(results.id), (results.x, results.y - 10), cv2.FONT_HERSHEY_PLAIN, 2, (245, 50, 16), 2)
     cv2.rectangle(frame, (results.x, results.y), (results.x + results.w, results.y + results.h), (245, 50, 16), 2)
 
+def draw_overlay(frame, fps: int, height: int, track_result: TrackingResult | None = None, 
+                 action_result: ActionDetectorResult | None = None):
+    """
+    Draws the tracking result, the action results and the text on the video frame in a single pass.
+
+    The FPS and the action results share one box of the heads-up display, which is only rendered again 
+    when a displayed value changes and is copied onto the frame once.
+
+    Parameters:
+        frame (numpy.ndarray): The video frame.
+        fps (int): The FPS of the video.
+        height (int): The height of the video.
+        track_result (TrackingResult | None): The tracking result if there is any.
+        action_result (ActionDetectorResult | None): The action detector result if there is any.
+    """
+    global _last_hud_patch
+
+    if track_result is not None:
+        draw_track_result(frame, track_result)
+
+    if action_result is not None:
+        key = (fps, action_result.action, int(action_result.probability * 1000))
+    else:
+        key = (fps, None, None)
+
+    if key != _last_hud_patch[0]:
+        lines = [('FPS: {}'.format(fps), (20, 30))]
+        if action_result is not None:
+            lines += [(f"Action: {key[1]}", (20, 70)), (f"Probability: {key[2] / 1000:.3f}", (20, 110))]
+        _last_hud_patch = (key, render_hud_patch(130 if action_result is not None else 50, lines))
+    blit_hud_patch(frame, _last_hud_patch[1])
+
+    # Quit Notification text
+    cv2.putText(frame, "Press 'Q' to Exit", (10, int(height) - 10), cv2.FONT_HERSHEY_PLAIN, 1, (255, 255, 255), 1)
+
+def pose_inference(frame, detector: PoseDetector, max_size: int | None = None) -> np.ndarray | None:
+    """
+    Performs pose estimation on the video frame without tracking.
+
+    Parameters:
+        frame (numpy.ndarray): The video frame.
+        detector (PoseDetector): The pose detector.
+        max_size (int | None): The maximum size of the longer side of the frame passed to the pose model, None to keep the original size.
+
+    Returns:
+        np.ndarray | None: The sequence of keypoints if the pose is valid.
+    """
+    keypoints, sequence = predict_pose(frame, detector, max_size)
+    return sequence if has_valid_pose(keypoints, sequence) else None
+
+def tracking_pose_inference(frame, model: YOLO, detector: PoseDetector) -> tuple[TrackingResult | None, np.ndarray | None]:
+    """
+    Performs human tracking and then pose estimation on the tracked person in the video frame.
+
+    Parameters:
+        frame (numpy.ndarray): The video frame.
+        model (YOLO): The YOLO model.
+        detector (PoseDetector): The pose detector.
+
+    Returns:
+        tuple[TrackingResult | None, np.ndarray | None]: The tracking result and the sequence of keypoints if the pose is valid.
+    """
+    tracking_result = track_person(frame, model)
+    if tracking_result is None:
+        return None, None
+
+    # The crop is filled by the tracked person, so it can be shrunk to the pose model's input size
+    sequence = pose_inference(tracking_result.roi, detector, POSE_INPUT_SIZE)
+    if sequence is None:
+        return None, None
+    return tracking_result, sequence
+
 def non_tracking_inference(frame, detector: PoseDetector) -> ActionDetectorResult | None:
     """
     Performs inference on the video frame without tracking. Only performs pose estimation and action recognition
@@ -238,9 +511,9 @@ def non_tracking_inference(frame, detector: PoseDetector) -> ActionDetectorResul
     Returns:
         ActionDetectorResult | None: The action detector result if there is any.
     """
-    keypoints, sequence = predict_pose(frame, detector)
+    sequence = pose_inference(frame, detector)
 
-    if has_valid_pose(keypoints, sequence):
+    if sequence is not None:
         action, probability = predict_action(detector, sequence)
         return ActionDetectorResult(action, probability)
     else:
@@ -258,16 +531,137 @@ def tracking_inference(frame, model: YOLO, detector: PoseDetector) -> tuple[Trac
     Returns:
         tuple[TrackingResult | None, ActionDetectorResult | None]: The tracking result and the action detector result if there is any.
     """
-    tracking_result = track_person(frame, model)
-    if tracking_result is None:
-        return None, None
+    tracking_result, sequence = tracking_pose_inference(frame, model, detector)
 
-    keypoints, sequence = predict_pose(tracking_result.roi, detector)
-
-    if has_valid_pose(keypoints, sequence):
+    if sequence is not None:
         action, probability = predict_action(detector, sequence)
         return tracking_result, ActionDetectorResult(action, probability)
     else:
         return None, None
 
+def non_tracking_inference_batch(frames: list, detector: PoseDetector) -> list[ActionDetectorResult | None]:
+    """
+    Performs inference on a batch of video frames without tracking. Pose estimation runs frame by frame
+    as it depends on the previous frames, while action recognition runs once for the whole batch.
+
+    Parameters:
+        frames (list): The video frames, in the order they were captured.
+        detector (PoseDetector): The pose detector.
+
+    Returns:
+        list[ActionDetectorResult | None]: The action detector result of each frame if there is any.
+    """
+    results = [None] * len(frames)
+    indices, sequences = [], []
+
+    for i, frame in enumerate(frames):
+        keypoints, sequence = predict_pose(frame, detector)
+        if has_valid_pose(keypoints, sequence):
+            indices.append(i)
+            # The sequence may be a view of the ring buffer, which the next frame overwrites
+            sequences.append(sequence.copy())
 
+    if sequences:
+        # Fan the batched predictions back out to the frames they belong to
+        for i, (action, probability) in zip(indices, predict_actions(detector, sequences)):
+            results[i] = ActionDetectorResult(action, probability)
+
+    return results
+
+def process_video_threads(video_source, callback, recorder=None, prefetch: int = PIPELINE_PREFETCH, 
+                          batch_size: int | None = None, display: bool = True) -> None:
+    """
+    Runs the frames of a started video source through a three-stage pipeline until the video ends or 'Q' is pressed.
+
+    A reader thread decodes the next frames and a writer thread records the previous frames while the calling 
+    thread runs the callback on the current frame. The callback and the display stay on the calling thread, 
+    so the models are only used from one thread and the window works on every platform.
+
+    With a batch size, the callback runs once per batch of consecutive frames, so the models can process 
+    the whole batch in one call. This delays the display by a batch, so it is only meant for pre-recorded videos.
+
+    A video source that decodes into a pool of frames needs a pool of get_frame_pool_size(batch_size, prefetch) 
+    frames, otherwise its frames are overwritten while they are still in the pipeline.
+
+    Parameters:
+        video_source (VideoSource): The started video source.
+        callback (Callable[[numpy.ndarray | list], None]): Performs inference on a video frame, or on a list of 
+            video frames if there is a batch size, and draws the results on them.
+        recorder (cv2.VideoWriter): The video recorder, None if the video is not recorded.
+        prefetch (int): The maximum number of frames waiting in each stage.
+        batch_size (int | None): The number of frames passed to the callback at once, None to pass each frame on its own.
+        display (bool): Whether to show the frames, the video can only be stopped early when they are shown.
+    """
+    read_queue = queue.Queue(maxsize=prefetch)
+    write_queue = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+
+    def read():
+        try:
+            while not stop.is_set():
+                has_frame, frame = video_source.next_frame()
+                if not has_frame:
+                    print("ERROR: No frame captured")
+                    break
+                read_queue.put(frame)
+        finally:
+            read_queue.put(None)
+
+    def write():
+        while (frame := write_queue.get()) is not None:
+            recorder.write(frame)
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    if recorder is not None:
+        writer = threading.Thread(target=write, daemon=True)
+        writer.start()
+
+    # Batches are only cut by their size, the video is not waited on
+    batcher = FrameBatcher(batch_size) if batch_size is not None else None
+
+    ended = False
+    try:
+        while not ended:
+            frame = read_queue.get()
+            ended = frame is None
+
+            # Run the callback on the frame, or on the batch once it is full or the video has ended
+            if batcher is None:
+                if ended:
+                    break
+                callback(frame)
+                frames = [frame]
+            else:
+                frames = batcher.flush() if ended else batcher.add(frame)
+                if not frames:
+                    continue
+                callback(frames)
+
+            closed = False
+            for frame in frames:
+                if recorder is not None:
+                    write_queue.put(frame)
+
+                if not display:
+                    continue
+
+                cv2.imshow("Frame", frame)
+
+                # Event handler
+                if cv2.waitKey(1) & 0xFF in (ord('q'), ord('Q')):
+                    closed = True
+                    break
+            if closed:
+                break
+    finally:
+        # Unblock the reader if it is waiting on a full queue, then wait for it to finish
+        stop.set()
+        while not ended:
+            ended = read_queue.get() is None
+        reader.join()
+
+        # Let the writer record the remaining frames
+        if recorder is not None:
+            write_queue.put(None)
+            writer.join()
@@ -19,9 +19,9 @@ from PyQt5 import QtCore, QtWidgets
 import sys
 from datetime import datetime
 
-from utils import get_recording_folder, get_unique_filename, WIDTH
+from utils import ensure_video_extension, get_recording_folder, get_unique_filename, WIDTH
 from stream_thread import StreamWorker
-from video_source import Drone, Webcam
+from video_source import Drone, VideoSource, Webcam
 
 class MainWindow(QMainWindow):
     """
@@ -33,6 +33,7 @@ class MainWindow(QMainWindow):
         __is_record (bool): Whether the stream should be recorded.
         __is_alert (bool): Whether the stream should show alert.
         __name (str): The name of the recording file.
+        __filename_dialog (QInputDialog): The dialog asking for the name of the recording file.
         __start_stream_button (QPushButton): The start stream button.
         __message_label (QLabel): The message label.
     """
@@ -51,6 +52,7 @@ class MainWindow(QMainWindow):
         self.__is_record = False
         self.__is_alert = False
         self.__name = None
+        self.__filename_dialog = None
 
         # Create an instance of a QBoxLayout layout (main layout).
         main_layout = QVBoxLayout()
@@ -158,9 +160,6 @@ class MainWindow(QMainWindow):
         """
         Function that is triggered when user clicks on the start stream button.
         """
-        # Create a QThreadPool instance.
-        pool = QtCore.QThreadPool.globalInstance()
-        
         # Identify which stream type
         if self.__stream_type == "Webcam":
             source = Webcam()
@@ -177,16 +176,31 @@ class MainWindow(QMainWindow):
         # Set up if recording is needed
         self.__name = None
         if self.__is_record:
-            # Ask for video name
-            self.__name, success = QInputDialog.getText(self, 
-                                                 'Request Filename', 
-                                                 'Enter a filename for the recording:',
-                                                 text=get_unique_filename(self.__stream_type, ".avi")
-                                                 )
-            if not success:
-                return None
-            elif self.__name[-4:] != ".avi" and self.__name[-4:] != ".mp4":
-                self.__name += ".avi"
+            # Ask for video name without blocking the event loop, the stream is launched once a name is entered
+            self.__filename_dialog = QInputDialog(self)
+            # Delete the dialog once it is closed, so the dialogs and the video sources they hold do not pile up
+            self.__filename_dialog.setAttribute(QtCore.Qt.WA_DeleteOnClose)
+            self.__filename_dialog.setWindowTitle('Request Filename')
+            self.__filename_dialog.setLabelText('Enter a filename for the recording:')
+            self.__filename_dialog.setTextValue(get_unique_filename(self.__stream_type, ".avi"))
+            self.__filename_dialog.textValueSelected.connect(lambda name: self.launchStream(source, name))
+            self.__filename_dialog.open()
+        else:
+            self.launchStream(source)
+
+    def launchStream(self, source: VideoSource, name: str = None) -> None:
+        """
+        Starts the stream worker thread on the video source.
+
+        Parameters:
+            source (VideoSource): The video source to stream from.
+            name (str): The filename of the recording, None if the stream is not recorded.
+        """
+        # Create a QThreadPool instance.
+        pool = QtCore.QThreadPool.globalInstance()
+
+        if name is not None:
+            self.__name = ensure_video_extension(name)
                 
         # Connect the signals so that the thread can communicate with the GUI.
         camera = StreamWorker(source=source, record=self.__is_record, filename=self.__name, alert=self.__is_alert)
@@ -8,15 +8,77 @@ Author: Lim Yun Feng, Ting Yi Xuan, Chua Sheen Wey
 Last Edited: 28/10/2023
 
 Components:
+    - convert_action_model: Converts the action recognition model to a quantized TFLite model.
+    - load_action_interpreter: Loads the TFLite action recognition model, on the GPU if it is available.
     - findPose: Detects the pose of a person in a video frame.
+    - prepare_input: Converts a video frame into the input of the pose model.
     - extract_keypoints: Extracts the pose keypoints from the video frame.
+    - push_keypoints: Extracts the pose keypoints into the next row of the sequence ring buffer.
+    - get_sequence: Returns the sequence of pose keypoints, oldest first.
+    - predict_sequence: Predicts the action probabilities of a sequence of pose keypoints.
+    - predict_sequences: Predicts the action probabilities of a batch of sequences of pose keypoints.
 """
+import os
+import functools
 import mediapipe as mp
 import numpy as np
 import tensorflow as tf
 import cv2
 
-from utils import MODEL_PATH
+from utils import ACTION_TFLITE_MODEL_PATH, INFERENCE_THREADS, MODEL_PATH, NUM_KEYPOINTS, POSE_DRAW_EVERY, \
+    POSE_MODEL_COMPLEXITY, SEQUENCE_LENGTH, TFLITE_GPU_DELEGATE_PATH
+
+@functools.lru_cache(maxsize=1)
+def _load_action_model():
+    """
+    Loads the Keras action recognition model once, so that every PoseDetector shares it.
+
+    Returns:
+        tensorflow.python.keras.engine.sequential.Sequential: The sequential model used to predict the pose.
+    """
+    return tf.keras.models.load_model(MODEL_PATH, compile=False)
+
+def convert_action_model(int8: bool = False) -> str:
+    """
+    Converts the action recognition model to a TFLite model, which PoseDetector uses instead of the Keras model 
+    once it exists. Only needs to be run once.
+
+    FP16 weights are portable across CPUs. Dynamic-range INT8 is smaller but can be slower than FP16 on x86 CPUs,
+    so benchmark both on the target machine before keeping the INT8 model.
+
+    Parameters:
+        int8 (bool): Whether to quantize the weights to INT8 (dynamic range) rather than FP16.
+
+    Returns:
+        str: The path of the converted model.
+    """
+    model = _load_action_model()
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if not int8:
+        converter.target_spec.supported_types = [tf.float16]
+
+    # Fall back to TensorFlow ops for any LSTM op without a TFLite builtin
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS]
+
+    with open(ACTION_TFLITE_MODEL_PATH, "wb") as f:
+        f.write(converter.convert())
+    return ACTION_TFLITE_MODEL_PATH
+
+def load_action_interpreter():
+    """
+    Loads the TFLite action recognition model. The TFLite GPU delegate is used if its library can be loaded 
+    and it accepts the model, otherwise the model runs on the CPU.
+
+    Returns:
+        tensorflow.lite.Interpreter: The interpreter of the TFLite sequential model.
+    """
+    try:
+        delegate = tf.lite.experimental.load_delegate(TFLITE_GPU_DELEGATE_PATH)
+        return tf.lite.Interpreter(model_path=ACTION_TFLITE_MODEL_PATH, experimental_delegates=[delegate])
+    except (ValueError, RuntimeError, OSError):
+        # No GPU delegate on this machine, or the model has ops the delegate does not support
+        return tf.lite.Interpreter(model_path=ACTION_TFLITE_MODEL_PATH, num_threads=INFERENCE_THREADS)
 
 class PoseDetector:
     """
@@ -24,81 +86,249 @@ class PoseDetector:
 
     Attributes:
         mode (bool): Whether to detect the pose in static image or video.
-        upBody (bool): Whether to detect the upper body pose.
+        upBody (bool): Whether to detect the upper body pose. Not supported by the pose model and kept for compatibility.
         smooth (bool): Whether to smooth the pose landmarks.
         detectionCon (float): Minimum confidence value for the pose detection to be considered successful.
         trackCon (float): Minimum confidence value for the pose tracking to be considered successful.
+        complexity (int): The complexity of the pose landmark model, 0 is the fastest.
+        drawEvery (int): The number of frames between each drawing of the pose landmarks.
+        _frame_idx (int): The number of frames the pose has been detected on.
         mpDraw (mediapipe.solutions.drawing_utils): Used to draw the pose landmarks on the video frame.
-        mpHolistic (mediapipe.solutions.holistic): Used to detect the pose of a person in a video frame.
-        holistic (mediapipe.solutions.holistic.Holistic): The holistic model.
-        drawSpec (mediapipe.solutions.drawing_utils.DrawingSpec): The drawing specification for the pose landmarks.
-        new_model (tensorflow.python.keras.engine.sequential.Sequential): The sequential model used to predict the pose.
-        sequence (list): The list of pose keypoints extracted from the video.
+        mpPose (mediapipe.solutions.pose): Used to detect the pose of a person in a video frame.
+        pose (mediapipe.solutions.pose.Pose): The pose model.
+        new_model (tensorflow.python.keras.engine.sequential.Sequential): The sequential model used to predict the pose, None if the TFLite model is used.
+        interpreter (tensorflow.lite.Interpreter): The interpreter of the TFLite sequential model, None if it has not been converted.
+        _rgb_buf (numpy.ndarray): The preallocated RGB input of the pose model, reallocated only when the input size changes.
+        _kp_buf (numpy.ndarray): The preallocated pose keypoints, used when no output array is given to extract_keypoints.
+        sequence (numpy.ndarray): The ring buffer of the last SEQUENCE_LENGTH pose keypoints extracted from the video, 
+            stored twice back to back so that every window is a contiguous slice.
+        _idx (int): The row of the sequence buffer that the next keypoints are written to.
+        _filled (int): The number of rows of the sequence buffer that hold keypoints.
         sentence (list): The list of predicted pose labels.
+        _action_input (numpy.ndarray): The preallocated (1, SEQUENCE_LENGTH, NUM_KEYPOINTS) input of the sequential model.
+        _predict_fn (tensorflow.types.experimental.ConcreteFunction): The traced forward pass of the sequential model, None if the TFLite model is used.
+        _input_idx (int): The index of the input tensor of the TFLite model.
+        _output_idx (int): The index of the output tensor of the TFLite model.
+        _interpreter_batch (int): The batch size the TFLite model's tensors are currently allocated for.
     """
 
-    def __init__(self, mode=False, upBody=False, smooth=True, detectionCon=0.5, trackCon=0.5):
+    def __init__(self, mode=False, upBody=False, smooth=True, detectionCon=0.5, trackCon=0.5, complexity=POSE_MODEL_COMPLEXITY,
+                 drawEvery=POSE_DRAW_EVERY):
         """
         The constructor for the PoseDetector class.
 
         Parameters:
             mode (bool): Whether to detect the pose in static image or video.
-            upBody (bool): Whether to detect the upper body pose.
+            upBody (bool): Whether to detect the upper body pose. Not supported by the pose model and kept for compatibility.
             smooth (bool): Whether to smooth the pose landmarks.
             detectionCon (float): Minimum confidence value for the pose detection to be considered successful.
             trackCon (float): Minimum confidence value for the pose tracking to be considered successful.
+            complexity (int): The complexity of the pose landmark model, 0 is the fastest.
+            drawEvery (int): The number of frames between each drawing of the pose landmarks, 1 to draw on every frame.
         """
         self.mode = mode
         self.upBody = upBody
         self.smooth = smooth
         self.detectionCon = detectionCon
         self.trackCon = trackCon
+        self.complexity = complexity
+        self.drawEvery = drawEvery
+        self._frame_idx = 0
 
+        # Only the pose landmarks are used, so the face and hand models of Holistic are not run
         self.mpDraw = mp.solutions.drawing_utils
-        self.mpHolistic = mp.solutions.holistic
-        self.holistic = self.mpHolistic.Holistic(self.mode, self.upBody, self.smooth, False, False, False,
-                                                 self.detectionCon, self.trackCon)
-        self.drawSpec = self.mpDraw.DrawingSpec((255, 0, 0), thickness=1, circle_radius=1)
+        self.mpPose = mp.solutions.pose
+        self.pose = self.mpPose.Pose(static_image_mode=self.mode, model_complexity=self.complexity,
+                                     smooth_landmarks=self.smooth, min_detection_confidence=self.detectionCon,
+                                     min_tracking_confidence=self.trackCon)
+
+        self._action_input = np.zeros((1, SEQUENCE_LENGTH, NUM_KEYPOINTS), dtype=np.float32)
+
+        if os.path.exists(ACTION_TFLITE_MODEL_PATH):
+            # Use the converted TFLite model, which is lighter to load and faster per frame
+            self.new_model = None
+            self._predict_fn = None
+            self.interpreter = load_action_interpreter()
+            self._input_idx = self.interpreter.get_input_details()[0]['index']
+            self._output_idx = self.interpreter.get_output_details()[0]['index']
+            self._interpreter_batch = None
+        else:
+            # Trace the forward pass of the Keras model once into a concrete function
+            self.new_model = _load_action_model()
+            self.interpreter = None
+            self._predict_fn = tf.function(lambda x: self.new_model(x, training=False)).get_concrete_function(
+                tf.TensorSpec((None, SEQUENCE_LENGTH, NUM_KEYPOINTS), tf.float32))
 
-        self.new_model = tf.keras.models.load_model(MODEL_PATH, compile=False)
-        self.sequence = []
+        # Run the model once so the first frame does not pay for its setup
+        self._run_action_model(self._action_input)
+        self._rgb_buf = None
+        self._kp_buf = np.zeros(NUM_KEYPOINTS, dtype=np.float32)
+        self.sequence = np.zeros((2 * SEQUENCE_LENGTH, NUM_KEYPOINTS), dtype=np.float32)
+        self._idx = 0
+        self._filled = 0
         self.sentence = []
 
-    def findPose(self, img, draw=True):
+    def findPose(self, img, draw=True, maxSize=None):
         """
         Detects the pose of a person in a video frame.
 
         Parameters:
             img (numpy.ndarray): The video frame.
-            draw (bool): Whether to draw the pose landmarks on the video frame.
+            draw (bool): Whether to draw the pose landmarks on the video frame, only every drawEvery frames.
+            maxSize (int): The maximum size of the longer side of the frame passed to the pose model, None to keep the original size.
 
         Returns:
             results (mediapipe.python.solution_base.SolutionOutputs): The pose landmarks.
             img (numpy.ndarray): The video frame with the pose landmarks drawn on it.
         """
-        imgRGB = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        results = self.holistic.process(imgRGB)
+        imgRGB = self.prepare_input(img, maxSize)
+        results = self.pose.process(imgRGB)
 
+        # Drawing is only for display, so it is skipped on most frames to keep it off the inference path
         if results.pose_landmarks:
-            if draw:
-                self.mpDraw.draw_landmarks(img, results.face_landmarks, self.mpHolistic.FACEMESH_CONTOURS,
-                                           self.drawSpec, self.drawSpec)
-                self.mpDraw.draw_landmarks(img, results.left_hand_landmarks, self.mpHolistic.HAND_CONNECTIONS)
-                self.mpDraw.draw_landmarks(img, results.right_hand_landmarks, self.mpHolistic.HAND_CONNECTIONS)
-                self.mpDraw.draw_landmarks(img, results.pose_landmarks, self.mpHolistic.POSE_CONNECTIONS)
+            if draw and self._frame_idx % self.drawEvery == 0:
+                self.mpDraw.draw_landmarks(img, results.pose_landmarks, self.mpPose.POSE_CONNECTIONS)
+        self._frame_idx += 1
 
         return results, img
 
-    def extract_keypoints(self, results):
+    def prepare_input(self, img, maxSize=None):
+        """
+        Converts a video frame into the RGB input of the pose model. The frame is shrunk first 
+        so that the colour conversion only runs over the pixels the model actually uses.
+
+        The landmarks are normalised to the frame size, so they can still be drawn on the original frame.
+
+        Parameters:
+            img (numpy.ndarray): The BGR video frame.
+            maxSize (int): The maximum size of the longer side of the input, None to keep the original size.
+
+        Returns:
+            numpy.ndarray: The RGB input of the pose model.
+        """
+        height, width = img.shape[:2]
+        if maxSize is not None and maxSize < max(height, width):
+            scale = maxSize / max(height, width)
+            height, width = max(1, round(height * scale)), max(1, round(width * scale))
+
+        # Write into the same buffer every frame instead of allocating a new one
+        shape = (height, width, img.shape[2])
+        if self._rgb_buf is None or self._rgb_buf.shape != shape:
+            self._rgb_buf = np.empty(shape, dtype=img.dtype)
+
+        # Shrink straight into the buffer and swap the channels in place, the swap is a single SIMD pass 
+        # while a sliced view would still need a contiguous copy for the pose model
+        if shape != img.shape:
+            cv2.resize(img, (width, height), dst=self._rgb_buf, interpolation=cv2.INTER_AREA)
+            cv2.cvtColor(self._rgb_buf, cv2.COLOR_BGR2RGB, dst=self._rgb_buf)
+        else:
+            cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=self._rgb_buf)
+
+        return self._rgb_buf
+
+    def extract_keypoints(self, results, out=None):
         """
         Extracts the pose keypoints from the video frame.
 
         Parameters:
             results (mediapipe.python.solution_base.SolutionOutputs): The pose landmarks.
+            out (numpy.ndarray): The float32 array of NUM_KEYPOINTS values the keypoints are written to, 
+                a buffer owned by the detector is reused if None.
+
+        Returns:
+            pose (numpy.ndarray): The pose keypoints, the array the keypoints were written to.
+        """
+        pose = self._kp_buf if out is None else out
+
+        if not results.pose_landmarks:
+            pose.fill(0)
+            return pose
+
+        # Stream the landmark values into a flat array in one pass, then copy it into the preallocated array
+        landmarks = results.pose_landmarks.landmark
+        pose[:] = np.fromiter((value for res in landmarks for value in (res.x, res.y, res.z, res.visibility)),
+                              dtype=np.float32, count=NUM_KEYPOINTS)
+        return pose
+
+    def push_keypoints(self, results):
+        """
+        Extracts the pose keypoints straight into the next row of the sequence ring buffer, 
+        overwriting the oldest keypoints once the buffer is full.
+
+        Parameters:
+            results (mediapipe.python.solution_base.SolutionOutputs): The pose landmarks.
+
+        Returns:
+            pose (numpy.ndarray): The pose keypoints, a view of their row in the ring buffer.
+        """
+        pose = self.extract_keypoints(results, out=self.sequence[self._idx])
+
+        # Mirror the row into the second half, so the window ending at this row never wraps around
+        self.sequence[self._idx + SEQUENCE_LENGTH] = pose
+        self._idx = (self._idx + 1) % SEQUENCE_LENGTH
+        self._filled = min(self._filled + 1, SEQUENCE_LENGTH)
+        return pose
+
+    def get_sequence(self):
+        """
+        Returns the sequence of pose keypoints in the ring buffer, oldest first.
+
+        The window is always a view of the buffer and is never copied, so it changes as new keypoints are pushed.
 
         Returns:
-            np.concatenate([pose]) (numpy.ndarray): The pose keypoints.
+            numpy.ndarray: The (number of keypoints so far, NUM_KEYPOINTS) sequence of pose keypoints, 
+                at most SEQUENCE_LENGTH long.
         """
-        pose = np.array([[res.x, res.y, res.z, res.visibility] for res in
-                         results.pose_landmarks.landmark]).flatten() if results.pose_landmarks else np.zeros(33 * 4)
-        return np.concatenate([pose])
\ No newline at end of file
+        if self._filled < SEQUENCE_LENGTH:
+            return self.sequence[:self._filled]
+        return self.sequence[self._idx:self._idx + SEQUENCE_LENGTH]
+
+    def predict_sequence(self, sequence):
+        """
+        Predicts the action probabilities of a sequence of pose keypoints.
+
+        The sequence is copied into a preallocated input, so this should only be called from one thread at a time.
+
+        Parameters:
+            sequence (numpy.ndarray): The (SEQUENCE_LENGTH, NUM_KEYPOINTS) sequence of pose keypoints, oldest first.
+
+        Returns:
+            numpy.ndarray: The probability of each action.
+        """
+        self._action_input[0] = sequence
+        return self._run_action_model(self._action_input)[0]
+
+    def predict_sequences(self, sequences):
+        """
+        Predicts the action probabilities of a batch of sequences of pose keypoints.
+
+        Parameters:
+            sequences (numpy.ndarray): The (B, SEQUENCE_LENGTH, NUM_KEYPOINTS) sequences of pose keypoints, oldest first.
+
+        Returns:
+            numpy.ndarray: The (B, number of actions) probabilities of each action.
+        """
+        return self._run_action_model(np.asarray(sequences, dtype=np.float32))
+
+    def _run_action_model(self, batch):
+        """
+        Runs the action recognition model on a batch of sequences, using the TFLite model if it has been converted.
+
+        Parameters:
+            batch (numpy.ndarray): The (B, SEQUENCE_LENGTH, NUM_KEYPOINTS) float32 sequences of pose keypoints.
+
+        Returns:
+            numpy.ndarray: The (B, number of actions) probabilities of each action.
+        """
+        if self.interpreter is None:
+            return self._predict_fn(tf.constant(batch)).numpy()
+
+        # The TFLite tensors are only reallocated when the batch size changes
+        if self._interpreter_batch != len(batch):
+            self.interpreter.resize_tensor_input(self._input_idx, batch.shape)
+            self.interpreter.allocate_tensors()
+            self._interpreter_batch = len(batch)
+
+        self.interpreter.set_tensor(self._input_idx, batch)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self._output_idx)
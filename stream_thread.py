@@ -6,12 +6,32 @@ Author: Lim Yun Feng, Ting Yi Xuan, Chua Sheen Wey
 Last Edited: 28/10/2023
 
 Components:
+    - put_latest: Puts an item on a queue, dropping the oldest pending items if it is full.
+    - ActionWorker: The worker thread that performs action recognition on the keypoint sequences produced by the StreamWorker.
+    - DisplayWorker: The worker thread that displays the frames produced by the StreamWorker.
     - StreamWorker: The worker thread that captures frames from a video source and performs inference on them.
 """
+import os
 import time
+import queue
+import threading
+from utils import INFERENCE_THREADS, OPENCV_THREADS
+
+# MediaPipe, TensorFlow, OpenCV and Torch each start a thread pool sized to every core, which fight over the CPU 
+# when they run side by side in the stream. The OpenMP cap must be set before the libraries are imported.
+os.environ.setdefault('OMP_NUM_THREADS', str(INFERENCE_THREADS))
+
+import cv2
+import torch
+import tensorflow as tf
 from PyQt5.QtCore import pyqtSignal, QObject, QRunnable
 from PyQt5 import QtCore
 from inference import *
+
+cv2.setNumThreads(OPENCV_THREADS)
+torch.set_num_threads(INFERENCE_THREADS)
+tf.config.threading.set_intra_op_parallelism_threads(INFERENCE_THREADS)
+tf.config.threading.set_inter_op_parallelism_threads(1)
 from video_source import VideoSource
 
 class Signals(QObject):
@@ -27,6 +47,169 @@ class Signals(QObject):
     complete = pyqtSignal(name="complete")
     alert = pyqtSignal(int, str, name="alert")
 
+def put_latest(q: queue.Queue, item) -> None:
+    """
+    Puts an item on a queue without blocking, dropping the oldest pending items if the queue is full 
+    so that the consumer keeps up with the stream.
+
+    Parameters:
+        q (queue.Queue): The queue.
+        item (any): The item to be queued.
+    """
+    while True:
+        try:
+            q.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                pass
+
+class ActionWorker:
+    """
+    Action recognition worker, consumes the keypoint sequences produced by the StreamWorker 
+    so that action recognition overlaps with the tracking and pose estimation of the next frame.
+
+    Attributes:
+        __detector (PoseDetector): The pose detector holding the action recognition model.
+        __queue (queue.Queue): The pending (subject ID, sequence) pairs, the oldest is dropped when full.
+        __result (tuple[int | None, ActionDetectorResult] | None): The subject ID and the latest action detector result.
+        __thread (threading.Thread): The thread that runs the action recognition.
+    """
+
+    def __init__(self, detector: PoseDetector):
+        """
+        The constructor for the ActionWorker class.
+
+        Parameters:
+            detector (PoseDetector): The pose detector holding the action recognition model.
+        """
+        self.__detector = detector
+        self.__queue = queue.Queue(maxsize=ACTION_QUEUE_SIZE)
+        self.__result = None
+        self.__thread = None
+
+    def start(self) -> None:
+        """
+        Starts the action recognition on its own thread, the global thread pool is already taken by the StreamWorker.
+        """
+        self.__thread = threading.Thread(target=self.run, daemon=True)
+        self.__thread.start()
+
+    def submit(self, subject_id: int | None, sequence: np.ndarray) -> None:
+        """
+        Queues a sequence of keypoints for action recognition.
+
+        Parameters:
+            subject_id (int | None): The ID of the tracked person, None if tracking is disabled.
+            sequence (np.ndarray): The sequence of keypoints.
+        """
+        # Copy as the sequence may be a view of the pose detector's ring buffer
+        put_latest(self.__queue, (subject_id, sequence.copy()))
+
+    def get_result(self) -> tuple[int | None, ActionDetectorResult] | None:
+        """
+        Returns the latest action detector result.
+
+        Returns:
+            tuple[int | None, ActionDetectorResult] | None: The subject ID and the action detector result if there is any.
+        """
+        return self.__result
+
+    def stop(self) -> None:
+        """
+        Stops the worker and waits for it to finish its current prediction.
+        """
+        put_latest(self.__queue, None)
+        if self.__thread is not None:
+            self.__thread.join()
+
+    def run(self) -> None:
+        """
+        The main function of the ActionWorker class.
+
+        Performs action recognition on each queued sequence until the worker is stopped.
+        """
+        while True:
+            item = self.__queue.get()
+            if item is None:
+                break
+
+            subject_id, sequence = item
+            action, probability = predict_action(self.__detector, sequence)
+            self.__result = (subject_id, ActionDetectorResult(action, probability))
+
+class DisplayWorker:
+    """
+    Display worker, shows the frames produced by the StreamWorker so that the stream never waits on the GUI.
+
+    Attributes:
+        __queue (queue.Queue): The frame waiting to be displayed, replaced by the latest frame when full.
+        __closed (bool): Whether the user has pressed 'Q' to close the stream.
+        __thread (threading.Thread): The thread that displays the frames.
+    """
+
+    def __init__(self):
+        """
+        The constructor for the DisplayWorker class.
+        """
+        self.__queue = queue.Queue(maxsize=1)
+        self.__closed = False
+        self.__thread = None
+
+    def start(self) -> None:
+        """
+        Starts showing the frames on a dedicated thread.
+        """
+        self.__thread = threading.Thread(target=self.run, daemon=True)
+        self.__thread.start()
+
+    def show(self, frame: np.ndarray) -> None:
+        """
+        Queues a frame to be displayed, replacing the frame waiting to be displayed if there is one.
+
+        Parameters:
+            frame (np.ndarray): The frame to be displayed.
+        """
+        put_latest(self.__queue, frame)
+
+    def is_closed(self) -> bool:
+        """
+        Returns whether the user has pressed 'Q' to close the stream.
+
+        Returns:
+            bool: Whether the stream should be closed.
+        """
+        return self.__closed
+
+    def stop(self) -> None:
+        """
+        Stops the worker and waits for it to close the display window.
+        """
+        put_latest(self.__queue, None)
+        if self.__thread is not None:
+            self.__thread.join()
+
+    def run(self) -> None:
+        """
+        The main function of the DisplayWorker class.
+
+        Displays each queued frame and handles the key events until the worker is stopped.
+        """
+        while True:
+            frame = self.__queue.get()
+            if frame is None:
+                break
+
+            cv2.imshow("Frame", frame)
+
+            # Event handler
+            if cv2.waitKey(1) & 0xFF in (ord('q'), ord('Q')):
+                self.__closed = True
+
+        cv2.destroyAllWindows()
+
 class StreamWorker(QRunnable):
     """
     Capture IP camera frames worker.
@@ -38,6 +221,8 @@ class StreamWorker(QRunnable):
         __record (bool): Whether to record the video.
         __alert (bool): Whether to alert when a malicious action is detected.
         __recorder (cv2.VideoWriter): The video recorder.
+        __record_queue (queue.Queue): The frames waiting to be recorded.
+        __record_thread (threading.Thread): The thread that writes the frames to the video recorder.
 
     """
    
@@ -70,73 +255,108 @@ class StreamWorker(QRunnable):
         # Emit start signal
         self.signals.start.emit(0)
 
-        # Initialize the detector
+        # Initialize the detector and the action recognition stage
         detector = PoseDetector()
-        pTime = 0
+        action_worker = ActionWorker(detector)
+        action_worker.start()
+
+        # Display the frames on their own thread
+        display_worker = DisplayWorker()
+        display_worker.start()
+        fps_counter = FpsCounter()
 
         # Initialize the human-tracking model if alert is enabled
         if self.__alert:
-            model = YOLO(OBJECT_TRACKING_MODEL_PATH)
-            mal_people = []
+            model = load_tracking_model()
+            mal_people = set()
 
         self.__video_source.start() 
+        self.__recorder = None
 
-        # Initialize the video recorder if recording is enabled
-        if self.__record:
-            self.__recorder = get_recorder(self.__filename, self.__video_source.get_width(), self.__video_source.get_height())
-        else:
-            self.__recorder = None
+        # Everything after the video source has started runs inside the try, so that its capture threads are always stopped
+        try:
+            # Initialize the video recorder if recording is enabled, the frames are encoded on their own thread
+            if self.__record:
+                self.__recorder = get_recorder(self.__filename, self.__video_source.get_width(), self.__video_source.get_height())
+                self.__record_queue = queue.Queue(maxsize=RECORD_QUEUE_SIZE)
+                self.__record_thread = threading.Thread(target=self.__record_frames, daemon=True)
+                self.__record_thread.start()
 
-        # Main loop
-        while True:
-            # Get frame from video source
-            has_frame, frame = self.__video_source.next_frame()
-            if not has_frame:
-                raise ValueError("No frame captured")
-            
-            # Perform inference based on whether alert is enabled
-            if self.__alert:
-                track_result, action_result = tracking_inference(frame, model, detector)
-            else:
-                action_result = non_tracking_inference(frame, detector)
-
-            # get the original frame from video source
-            has_frame, frame = self.__video_source.get_display_frame()
-
-            # If alert is enabled, draw output of human-tracking model and alert if a malicious action is detected
-            if self.__alert and track_result is not None:
-                draw_track_result(frame, track_result)
-
-                if action_result.action in MAL_ACTIONS and track_result.id not in mal_people:
-                    mal_people.append(track_result.id)
-                    self.signals.alert.emit(track_result.id, action_result.action)
-
-            # display the output of action recognition model
-            if action_result is not None:
-                draw_action_results(frame, action_result.action, action_result.probability)
-            
-            # Calculate FPS and display it
-            cTime = time.time()
-            fps = 1 // (cTime - pTime)
-            pTime = cTime
-            draw_text(frame, fps, self.__video_source.get_height())
-            
-            # Record the frame if recording is enabled
-            if self.__recorder is not None:
-                self.__recorder.write(frame)
-            
-            # Display the frame
-            cv2.imshow("Frame", frame)
+            # Process frames no faster than the video source delivers them, so the loop sleeps instead of polling
+            frame_time = 1.0 / (self.__video_source.get_fps() or INFERENCE_FPS)
 
-            # Event handler
-            if cv2.waitKey(1) & 0xFF in (ord('q'), ord('Q')):
-                break
+            # Main loop
+            while True:
+                frame_start = time.perf_counter()
+
+                # Get frame from video source, the same frame is used for inference, drawing and recording
+                has_frame, frame = self.__video_source.next_frame()
+                if not has_frame:
+                    raise ValueError("No frame captured")
                 
-        if self.__recorder is not None:
-            self.__recorder.release()
+                # Perform tracking and pose estimation based on whether alert is enabled
+                track_result, subject_id = None, None
+                if self.__alert:
+                    track_result, sequence = tracking_pose_inference(frame, model, detector)
+                    if track_result is not None:
+                        subject_id = track_result.id
+                else:
+                    sequence = pose_inference(frame, detector)
 
-        self.__video_source.exit()
-        cv2.destroyAllWindows()
+                # Hand the sequence over to the action recognition stage and use its latest result
+                action_result = None
+                if sequence is not None:
+                    action_worker.submit(subject_id, sequence)
+                    latest_result = action_worker.get_result()
+                    if latest_result is not None:
+                        action_subject_id, action_result = latest_result
+
+                # If alert is enabled, alert if a malicious action is detected
+                if self.__alert and track_result is not None:
+                    if action_result is not None and action_subject_id == track_result.id \
+                            and action_result.action in MAL_ACTIONS and track_result.id not in mal_people:
+                        mal_people.add(track_result.id)
+                        self.signals.alert.emit(track_result.id, action_result.action)
+
+                # Draw the output of the human-tracking and action recognition models and the FPS in one pass
+                draw_overlay(frame, fps_counter.update(), self.__video_source.get_height(), track_result, action_result)
+                
+                # Record the frame if recording is enabled, this only waits if the encoder has fallen behind
+                if self.__recorder is not None:
+                    self.__record_queue.put(frame)
+                
+                # Display the frame, the stream does not wait for it to be shown
+                display_worker.show(frame)
+
+                # Stop when the user has pressed 'Q' on the display window
+                if display_worker.is_closed():
+                    break
+
+                # Sleep for the rest of the frame time
+                remaining = frame_start + frame_time - time.perf_counter()
+                if remaining > 0:
+                    time.sleep(remaining)
+        finally:
+            action_worker.stop()
+            display_worker.stop()
+
+            # Let the recorder finish the queued frames
+            if self.__recorder is not None:
+                self.__record_queue.put(None)
+                self.__record_thread.join()
+                self.__recorder.release()
+
+            # Always release the video source, which also stops its background threads such as the drone heartbeat
+            self.__video_source.exit()
 
         self.signals.complete.emit()
-     
\ No newline at end of file
+     
+
+    def __record_frames(self) -> None:
+        """
+        Writes the queued frames to the video recorder until None is queued.
+
+        The encoding runs in OpenCV without holding the GIL, so it overlaps with the inference of the next frames.
+        """
+        while (frame := self.__record_queue.get()) is not None:
+            self.__recorder.write(frame)
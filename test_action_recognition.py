@@ -6,12 +6,15 @@ from utils import *
 from video_source import PreRecorded, VideoSource, Webcam
 
 
-def stream(video_source: VideoSource, record: bool = False, filename: str = None):
-    results_history = []
+def stream(video_source: VideoSource, record: bool = False, filename: str = None, display: bool = True):
+    # The summed probability of each action over the frames, updated once per batch of frames
+    action_history = np.zeros(len(ACTIONS))
+    action_ids = {action: i for i, action in enumerate(ACTIONS)}
 
     # Initialize the detector
     detector = PoseDetector()
-    pTime = 0
+    pTime = time.perf_counter()
+    fps_counter = FpsCounter()
 
     video_source.start() 
 
@@ -22,37 +25,34 @@ def stream(video_source: VideoSource, record: bool = False, filename: str = None
     else:
         recorder = None
 
-    while True:
-        has_frame, frame = video_source.next_frame()
-        if not has_frame:
-            print("ERROR: No frame captured")
-            break 
+    def process(frames):
+        nonlocal pTime
+        # Action recognition runs once for the whole batch of frames
+        action_results = non_tracking_inference_batch(frames, detector)
 
-        
-        action_result = non_tracking_inference(frame, detector)
+        # Calculate FPS, the displayed FPS is smoothed and only rendered again when it changes
+        cTime = time.perf_counter()
+        fps = len(frames) / max(cTime - pTime, 1e-6)
+        pTime = cTime
+        display_fps = fps_counter.update(len(frames))
 
-        has_frame, frame = video_source.get_display_frame()
+        # Add the probabilities of the batch to their actions in a single call
+        results = [action_result for action_result in action_results if action_result is not None]
+        if results:
+            action_history[:] += np.bincount([action_ids[result.action] for result in results], 
+                                             weights=[result.probability for result in results], 
+                                             minlength=len(ACTIONS))
 
-        results_history.append(action_result)
+        for frame, action_result in zip(frames, action_results):
+            if action_result is not None:
+                draw_action_results(frame, action_result.action, action_result.probability)
 
-        if action_result is not None:
-            draw_action_results(frame, action_result.action, action_result.probability)
-        
-        # Calculate FPS
-        cTime = time.time()
-        fps = 1 // (cTime - pTime)
-        pTime = cTime
-        fps_list.append(fps)
-        draw_text(frame, fps, video_source.get_height())
-        
-        if recorder is not None:
-            recorder.write(frame)
-        
-        cv2.imshow("Frame", frame)
-
-        # Event handler
-        if cv2.waitKey(1) & 0xFF in (ord('q'), ord('Q')):
-            break
+            fps_list.append(fps)
+            if display:
+                draw_text(frame, display_fps, video_source.get_height())
+
+    # Decode, inference and recording overlap on separate threads, the frames are processed in batches
+    process_video_threads(video_source, process, recorder, batch_size=BATCH_SIZE, display=display)
 
     if recorder is not None:
         recorder.release()
@@ -61,15 +61,11 @@ def stream(video_source: VideoSource, record: bool = False, filename: str = None
     cv2.destroyAllWindows()
     
     # Find in history the most common action name of the tracked person
-    action_history = {"Kicking": 0, "Punching": 0, "Running": 0, "Waving": 0, "Walking": 0}
-    for action_result in results_history:
-        if action_result is not None:
-            action_history[action_result.action] += action_result.probability
-
-    max_action = max(action_history, key=action_history.get)
+    max_id = int(action_history.argmax())
+    max_action = ACTIONS[max_id]
     print("Most common action:", max_action)
     
-    if action_history[max_action] == 0:
+    if action_history[max_id] == 0:
         max_action = None
     return sum(fps_list) / len(fps_list), max_action
 
@@ -1,5 +1,4 @@
 from time import sleep
-from cv2 import VideoCapture
 import cv2
 
 from inference import draw_action_results, draw_text, predict_pose
@@ -15,6 +14,11 @@ LIVING_ROOM_IMG_FILE = "assets/living_room.jpg"
 
 
 class TestDraw(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Load the models once for every test, the images are unrelated stills so the pose is not tracked between them
+        cls.detector = PoseDetector(mode=True)
    
     def test_draw_text(self):
         print("\nTest draw text")
@@ -22,10 +26,9 @@ class TestDraw(unittest.TestCase):
 
         for i, fps in enumerate(test):
             print("Test {}: with FPS".format(i), fps)
-            cap = VideoCapture(BLANK_IMG_FILE)
-            frame = cap.read()[1]
+            frame = cv2.imread(BLANK_IMG_FILE)
 
-            draw_text(frame, 30, int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            draw_text(frame, 30, frame.shape[0])
             cv2.imshow("Test with FPS" + str(fps), frame)
             cv2.waitKey(1)
             self.assertTrue(frame is not None    , "Frame is None")
@@ -33,7 +36,6 @@ class TestDraw(unittest.TestCase):
 
             sleep(SLEEP_TIME)
             cv2.destroyAllWindows()
-            cap.release()
 
     def test_draw_pose(self):
         # Test with no  human
@@ -45,21 +47,17 @@ class TestDraw(unittest.TestCase):
 
         for i, img in enumerate(imgs):
             print("Test ", str(i), ":", tests[i])
-            cap = VideoCapture(img)
-            frame = cap.read()[1]
+            frame = cv2.imread(img)
 
             self.assertTrue(frame is not None    , "Frame is None")
             print("PASSED")
 
-            detector = PoseDetector()
-            predict_pose(frame, detector)
+            predict_pose(frame, self.detector)
 
             cv2.imshow(tests[i], frame)
             cv2.waitKey(1)
 
             sleep(SLEEP_TIME)
-            
-            cap.release()
             cv2.destroyAllWindows()
 
     def test_draw_action(self):
@@ -71,8 +69,7 @@ class TestDraw(unittest.TestCase):
         for i, action in enumerate(actions):
             print("Test" + str(i), ": Test with action {} with probability of {}".format(action, probability[i]))
             
-            cap = VideoCapture(BLANK_IMG_FILE)
-            frame = cap.read()[1]
+            frame = cv2.imread(BLANK_IMG_FILE)
 
             draw_action_results(frame, action, probability[i])
             cv2.imshow("Test with action {} with probability of {}".format(action, probability[i]), frame)
@@ -82,7 +79,6 @@ class TestDraw(unittest.TestCase):
 
             sleep(SLEEP_TIME)
             cv2.destroyAllWindows()
-            cap.release()
 
 if __name__ == '__main__':
     unittest.main()
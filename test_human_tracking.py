@@ -1,18 +1,22 @@
 import time
-from cv2 import VideoCapture
+from collections import Counter
 from ultralytics import YOLO
 from inference import *
 from pose_detector import PoseDetector
 from utils import *
 from video_source import PreRecorded, VideoSource
 
-def stream(video_source: VideoSource, record: bool = False, filename: str = None):
+def stream(video_source: VideoSource, record: bool = False, filename: str = None, display: bool = True):
     # Initialize the detector
-    model = YOLO(OBJECT_TRACKING_MODEL_PATH)
-    pTime = 0
+    model = load_tracking_model()
+    pTime = time.perf_counter()
+    fps_counter = FpsCounter()
 
     fps_list = []
 
+    # The number of frames each subject ID was tracked in
+    id_counts = Counter()
+
     video_source.start() 
 
     if record:
@@ -20,33 +24,23 @@ def stream(video_source: VideoSource, record: bool = False, filename: str = None
     else:
         recorder = None
 
-    while True:
-        has_frame, frame = video_source.next_frame()
-        if not has_frame:
-            print("ERROR: No frame captured")
-            break 
-
+    def process(frame):
+        nonlocal pTime
         tracking_result = track_person(frame, model)
-        has_frame, frame = video_source.get_display_frame()
 
         if tracking_result is not None:
+            id_counts[tracking_result.id] += 1
             draw_track_result(frame, tracking_result)
 
-        # Calculate FPS
-        cTime = time.time()
-        fps = 1 // (cTime - pTime)
+        # Calculate FPS, the displayed FPS is smoothed and only rendered again when it changes
+        cTime = time.perf_counter()
+        fps_list.append(1 / max(cTime - pTime, 1e-6))
         pTime = cTime
-        fps_list.append(fps)
-        draw_text(frame, fps, video_source.get_height())
-
-        if recorder is not None:
-            recorder.write(frame)
-        
-        cv2.imshow("Frame", frame)
+        if display:
+            draw_text(frame, fps_counter.update(), video_source.get_height())
 
-        # Event handler
-        if cv2.waitKey(1) & 0xFF in (ord('q'), ord('Q')):
-            break
+    # Decode, inference and recording overlap on separate threads
+    process_video_threads(video_source, process, recorder, display=display)
 
     if recorder is not None:
         recorder.release()
@@ -54,13 +48,16 @@ def stream(video_source: VideoSource, record: bool = False, filename: str = None
     video_source.exit()
     cv2.destroyAllWindows()
 
+    # Find the subject ID that was tracked the longest
+    max_id = id_counts.most_common(1)[0][0] if id_counts else None
+    print("Most tracked ID:", max_id)
+
     return sum(fps_list) / len(fps_list)
 
 def one_frame(img_path: str):
-    cap = VideoCapture(img_path)
-    frame = cap.read()[1]
+    frame = cv2.imread(img_path)
 
-    model = YOLO(OBJECT_TRACKING_MODEL_PATH)
+    model = load_tracking_model()
     result = track_person(frame, model)
     
     detector = PoseDetector()
@@ -70,8 +67,7 @@ def one_frame(img_path: str):
     cv2.waitKey(1)
 
     time.sleep(5)
-    
-    cap.release()
+
     cv2.destroyAllWindows()
     return result
 
@@ -86,7 +82,7 @@ def test_human_tracking():
     video_name = "basic_kicking.avi"
     f.write("Test {}: Basic human tracking\n".format(test_code))
     try:
-        fps_result = stream(PreRecorded("assets/test_3_2_1/" + video_name), record=True, filename=video_name)
+        fps_result = stream(PreRecorded("assets/test_3_2_1/" + video_name, pool_size=get_frame_pool_size()), record=True, filename=video_name)
         f.write("FPS: {}\n".format(fps_result))
     except Exception as e:
         f.write("Test {}: ERROR ({})\n".format(test_code, e))
@@ -99,7 +95,7 @@ def test_human_tracking():
     video_name = "low_light_kicking.avi"
     f.write("Test {}: Low light human tracking\n".format(test_code))
     try:
-        fps_result = stream(PreRecorded("assets/test_3_2_1/" + video_name), record=True, filename=video_name)
+        fps_result = stream(PreRecorded("assets/test_3_2_1/" + video_name, pool_size=get_frame_pool_size()), record=True, filename=video_name)
         f.write("FPS: {}\n".format(fps_result))
     except Exception as e:
         f.write("Test {}: ERROR ({})\n".format(test_code, e))
@@ -113,7 +109,7 @@ def test_human_tracking():
     video_name = "high_fps_kicking.mp4"
     f.write("Test {}: High FPS human tracking\n".format(test_code))
     try:
-        fps_result = stream(PreRecorded("assets/test_3_2_1/" + video_name), record=True, filename=video_name)
+        fps_result = stream(PreRecorded("assets/test_3_2_1/" + video_name, pool_size=get_frame_pool_size()), record=True, filename=video_name)
         f.write("FPS: {}\n".format(fps_result))
     except Exception as e:
         f.write("Test {}: ERROR ({})\n".format(test_code, e))
@@ -127,7 +123,7 @@ def test_human_tracking():
     video_name = "low_fps_kicking.mp4"
     f.write("Test {}: Low FPS human tracking\n".format(test_code))
     try:
-        fps_result = stream(PreRecorded("assets/test_3_2_1/" + video_name), record=True, filename=video_name)
+        fps_result = stream(PreRecorded("assets/test_3_2_1/" + video_name, pool_size=get_frame_pool_size()), record=True, filename=video_name)
         f.write("FPS: {}\n".format(fps_result))
     except Exception as e:
         f.write("Test {}: ERROR ({})\n".format(test_code, e))
@@ -140,7 +136,7 @@ def test_human_tracking():
     video_name = "no_human.mp4"
     f.write("Test {}: No Human human tracking\n".format(test_code))
     try:
-        fps_result = stream(PreRecorded("assets/test_3_2_1/" + video_name), record=True, filename=video_name)
+        fps_result = stream(PreRecorded("assets/test_3_2_1/" + video_name, pool_size=get_frame_pool_size()), record=True, filename=video_name)
         f.write("FPS: {}\n".format(fps_result))
     except Exception as e:
         f.write("Test {}: ERROR ({})\n".format(test_code, e))
@@ -153,7 +149,7 @@ def test_human_tracking():
     video_name = "multiple_human_walking.mp4"
     f.write("Test {}: Multiple Human human tracking\n".format(test_code))
     try:
-        fps_result = stream(PreRecorded("assets/test_3_2_1/" + video_name), record=True, filename=video_name)
+        fps_result = stream(PreRecorded("assets/test_3_2_1/" + video_name, pool_size=get_frame_pool_size()), record=True, filename=video_name)
         f.write("FPS: {}\n".format(fps_result))
     except Exception as e:
         f.write("Test {}: ERROR ({})\n".format(test_code, e))
@@ -166,7 +162,7 @@ def test_human_tracking():
     video_name = "large_human.avi"
     f.write("Test {}: Large Scale human tracking\n".format(test_code))
     try:
-        fps_result = stream(PreRecorded("assets/test_3_2_2/" + video_name), record=True, filename=video_name)
+        fps_result = stream(PreRecorded("assets/test_3_2_2/" + video_name, pool_size=get_frame_pool_size()), record=True, filename=video_name)
         f.write("FPS: {}\n".format(fps_result))
     except Exception as e:
         f.write("Test {}: ERROR ({})\n".format(test_code, e))
@@ -179,7 +175,7 @@ def test_human_tracking():
     video_name = "small_human.mp4"
     f.write("Test {}: Small scale human tracking\n".format(test_code))
     try:
-        fps_result = stream(PreRecorded("assets/test_3_2_2/" + video_name), record=True, filename=video_name)
+        fps_result = stream(PreRecorded("assets/test_3_2_2/" + video_name, pool_size=get_frame_pool_size()), record=True, filename=video_name)
         f.write("FPS: {}\n".format(fps_result))
     except Exception as e:
         f.write("Test {}: ERROR ({})\n".format(test_code, e))
@@ -192,7 +188,7 @@ def test_human_tracking():
     video_name = "top_down_kicking.avi"
     f.write("Test {}: Top Down human tracking\n".format(test_code))
     try:
-        fps_result = stream(PreRecorded("assets/test_3_2_1/" + video_name), record=True, filename=video_name)
+        fps_result = stream(PreRecorded("assets/test_3_2_1/" + video_name, pool_size=get_frame_pool_size()), record=True, filename=video_name)
         f.write("FPS: {}\n".format(fps_result))
     except Exception as e:
         f.write("Test {}: ERROR ({})\n".format(test_code, e))
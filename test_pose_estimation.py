@@ -1,15 +1,15 @@
 import time
-from cv2 import VideoCapture
 from ultralytics import YOLO
 from inference import *
 from pose_detector import PoseDetector
 from utils import *
-from video_source import PreRecorded, VideoSource
+from video_source import PreRecordedParallel, VideoSource
 
-def stream(video_source: VideoSource, record: bool = False, filename: str = None):
+def stream(video_source: VideoSource, record: bool = False, filename: str = None, display: bool = True):
     # Initialize the detector
     detector = PoseDetector()
-    pTime = 0
+    pTime = time.perf_counter()
+    fps_counter = FpsCounter()
 
     video_source.start() 
 
@@ -20,30 +20,19 @@ def stream(video_source: VideoSource, record: bool = False, filename: str = None
     else:
         recorder = None
 
-    while True:
-        has_frame, frame = video_source.next_frame()
-        if not has_frame:
-            print("ERROR: No frame captured")
-            break 
+    def process(frame):
+        nonlocal pTime
+        predict_pose(frame, detector=detector)
 
-        action_result = predict_pose(frame, detector=detector)
-        has_frame, frame = video_source.get_display_frame()
-
-        # Calculate FPS
-        cTime = time.time()
-        fps = 1 // (cTime - pTime)
+        # Calculate FPS, the displayed FPS is smoothed and only rendered again when it changes
+        cTime = time.perf_counter()
+        fps_list.append(1 / max(cTime - pTime, 1e-6))
         pTime = cTime
-        fps_list.append(fps)
-        draw_text(frame, fps, video_source.get_height())
-        
-        if recorder is not None:
-            recorder.write(frame)
-        
-        cv2.imshow("Frame", frame)
-
-        # Event handler
-        if cv2.waitKey(1) & 0xFF in (ord('q'), ord('Q')):
-            break
+        if display:
+            draw_text(frame, fps_counter.update(), video_source.get_height())
+
+    # Decode, inference and recording overlap on separate threads
+    process_video_threads(video_source, process, recorder, display=display)
 
     if recorder is not None:
         recorder.release()
@@ -54,10 +43,9 @@ def stream(video_source: VideoSource, record: bool = False, filename: str = None
     return sum(fps_list) / len(fps_list)
 
 def one_frame(img_path: str):
-    cap = VideoCapture(img_path)
-    frame = cap.read()[1]
+    frame = cv2.imread(img_path)
 
-    model = YOLO(OBJECT_TRACKING_MODEL_PATH)
+    model = load_tracking_model()
     result = track_person(frame, model)
     
     detector = PoseDetector()
@@ -67,8 +55,7 @@ def one_frame(img_path: str):
     cv2.waitKey(1)
 
     time.sleep(5)
-    
-    cap.release()
+
     cv2.destroyAllWindows()
     return result
 
@@ -83,7 +70,7 @@ def test_pose_estimation():
     # video_name = "basic_kicking.avi"
     # f.write("Test {}: Basic pose estimation\n".format(test_code))
     # try:
-    #     fps_result = stream(PreRecorded("assets/test_3_2_1/" + video_name), record=True, filename=video_name)
+    #     fps_result = stream(PreRecordedParallel("assets/test_3_2_1/" + video_name), record=True, filename=video_name, display=False)
     #     f.write("FPS: {}\n".format(fps_result))
     # except Exception as e:
     #     f.write("Test {}: ERROR ({})\n".format(test_code, e))
@@ -96,7 +83,7 @@ def test_pose_estimation():
     # video_name = "low_light_kicking.avi"
     # f.write("Test {}: Low light pose estimation\n".format(test_code))
     # try:
-    #     fps_result = stream(PreRecorded("assets/test_3_2_1/" + video_name), record=True, filename=video_name)
+    #     fps_result = stream(PreRecordedParallel("assets/test_3_2_1/" + video_name), record=True, filename=video_name, display=False)
     #     f.write("FPS: {}\n".format(fps_result))
     # except Exception as e:
     #     f.write("Test {}: ERROR ({})\n".format(test_code, e))
@@ -110,7 +97,7 @@ def test_pose_estimation():
     # video_name = "high_fps_kicking.mp4"
     # f.write("Test {}: High FPS pose estimation\n".format(test_code))
     # try:
-    #     fps_result = stream(PreRecorded("assets/test_3_2_1/" + video_name), record=True, filename=video_name)
+    #     fps_result = stream(PreRecordedParallel("assets/test_3_2_1/" + video_name), record=True, filename=video_name, display=False)
     #     f.write("FPS: {}\n".format(fps_result))
     # except Exception as e:
     #     f.write("Test {}: ERROR ({})\n".format(test_code, e))
@@ -124,7 +111,7 @@ def test_pose_estimation():
     # video_name = "low_fps_kicking.mp4"
     # f.write("Test {}: Low FPS pose estimation\n".format(test_code))
     # try:
-    #     fps_result = stream(PreRecorded("assets/test_3_2_1/" + video_name), record=True, filename=video_name)
+    #     fps_result = stream(PreRecordedParallel("assets/test_3_2_1/" + video_name), record=True, filename=video_name, display=False)
     #     f.write("FPS: {}\n".format(fps_result))
     # except Exception as e:
     #     f.write("Test {}: ERROR ({})\n".format(test_code, e))
@@ -137,7 +124,7 @@ def test_pose_estimation():
     # video_name = "no_human.mp4"
     # f.write("Test {}: No Human pose estimation\n".format(test_code))
     # try:
-    #     fps_result = stream(PreRecorded("assets/test_3_2_1/" + video_name), record=True, filename=video_name)
+    #     fps_result = stream(PreRecordedParallel("assets/test_3_2_1/" + video_name), record=True, filename=video_name, display=False)
     #     f.write("FPS: {}\n".format(fps_result))
     # except Exception as e:
     #     f.write("Test {}: ERROR ({})\n".format(test_code, e))
@@ -150,7 +137,7 @@ def test_pose_estimation():
     video_name = "multiple_human_walking.mp4"
     f.write("Test {}: Multiple Human pose estimation\n".format(test_code))
     try:
-        fps_result = stream(PreRecorded("assets/test_3_2_1/" + video_name), record=True, filename=video_name)
+        fps_result = stream(PreRecordedParallel("assets/test_3_2_1/" + video_name), record=True, filename=video_name, display=False)
         f.write("FPS: {}\n".format(fps_result))
     except Exception as e:
         f.write("Test {}: ERROR ({})\n".format(test_code, e))
@@ -189,7 +176,7 @@ def test_pose_estimation():
     # video_name = "top_down_kicking.avi"
     # f.write("Test {}: Top Down pose estimation\n".format(test_code))
     # try:
-    #     fps_result = stream(PreRecorded("assets/test_3_2_1/" + video_name), record=True, filename=video_name)
+    #     fps_result = stream(PreRecordedParallel("assets/test_3_2_1/" + video_name), record=True, filename=video_name, display=False)
     #     f.write("FPS: {}\n".format(fps_result))
     # except Exception as e:
     #     f.write("Test {}: ERROR ({})\n".format(test_code, e))
@@ -5,26 +5,63 @@ Author: Lim Yun Feng, Ting Yi Xuan, Chua Sheen Wey
 Last Edited: 28/10/2023
 
 Components:
-    - MainWindow: The main window of the application
-    - main: The main (funciton) entry point of the application
+    - get_recording_folder: Returns the path to the recording folder.
+    - get_unique_filename: Returns a unique filename for the recording.
+    - ensure_video_extension: Returns the filename with a video extension.
+    - get_frame_pool_size: Returns the number of pooled frames a video source needs in the test stream pipeline.
+    - FpsCounter: Smooths the measured FPS for display.
 """
 import os
+import re
+import time
 
 # Frame configurations
 WIDTH, HEIGHT = 1200, 800
 SEQUENCE_LENGTH = 30
+NUM_KEYPOINTS = 33 * 4
+POSE_INPUT_SIZE = 256
+POSE_MODEL_COMPLEXITY = 0
+POSE_DRAW_EVERY = 1
 VIDEO_FPS = 5
+INFERENCE_FPS = 15
+DRONE_FPS = 30
+DRONE_WIDTH, DRONE_HEIGHT = 960, 720
+DRONE_USE_OPENCL = True
+DRONE_HEARTBEAT_INTERVAL = 0.2
+FPS_SMOOTHING = 0.1
+FPS_DISPLAY_INTERVAL = 0.5
+
+# Batch configurations
+BATCH_SIZE = 8
+ACTION_QUEUE_SIZE = 2
+PIPELINE_PREFETCH = 4
+RECORD_QUEUE_SIZE = 4
+PARALLEL_DECODE_WORKERS = 4
+PARALLEL_DECODE_BUFFER = 64
+
+# Thread configurations
+INFERENCE_THREADS = 2
+OPENCV_THREADS = 1
 
 # App configurations
 APP_NAME = "Action Recognition"
 APP_AUTHOR = "MCS23"
-RECORDING_PATH = 'behaviour_recognition_recordings'
+RECORDING_PATH = os.environ.get('RECORDING_PATH', 'behaviour_recognition_recordings')
+VIDEO_EXTENSIONS = ('.avi', '.mp4')
+# MJPEG is an intra-frame codec, much cheaper to encode live than XVID/H.264
+RECORD_FOURCC = 'MJPG'
 
 # Model configurations
-MODEL_PATH = "./lstm_action_recognition.h5"
+MODEL_PATH = os.environ.get("MODEL_PATH", "./lstm_action_recognition.h5")
+# The TFLite conversion sits next to the Keras model, so overriding MODEL_PATH never picks up a stale conversion
+ACTION_TFLITE_MODEL_PATH = os.path.splitext(MODEL_PATH)[0] + ".tflite"
+TFLITE_GPU_DELEGATE_PATH = "libtensorflowlite_gpu_delegate.so"
 OBJECT_TRACKING_MODEL_PATH = "yolov8n_human_tracking.pt"
-ACTIONS = {0: 'Running', 1: 'Punching', 2: 'Waving' , 3: 'Kicking', 4: 'Walking'}
-MAL_ACTIONS = ['Punching', 'Kicking']
+OBJECT_TRACKING_ENGINE_PATH = "yolov8n_human_tracking.engine"
+OBJECT_TRACKING_OPENVINO_PATH = "yolov8n_human_tracking_openvino_model/"
+ACTIONS = ('Running', 'Punching', 'Waving', 'Kicking', 'Walking')
+MAL_ACTIONS = frozenset(('Punching', 'Kicking'))
+MIN_ROI_AREA = 32 * 32
 
 
 def get_recording_folder() -> str:
@@ -49,12 +86,93 @@ def get_unique_filename(stream_type: str, extension: str) -> str:
     Returns:
         str: The unique filename for the recording.
     """
-    path = get_recording_folder()
-    result = stream_type
+    # Read the folder once instead of checking each candidate filename
+    with os.scandir(get_recording_folder()) as entries:
+        existing = {entry.name for entry in entries}
+    if stream_type + extension not in existing:
+        return stream_type + extension
+
+    # Number the recording after the highest numbered recording of the stream type
+    pattern = re.compile(re.escape(stream_type) + r"_(\d+)" + re.escape(extension) + "$")
+    numbers = [int(match.group(1)) for name in existing if (match := pattern.match(name))]
+    return "{}_{}{}".format(stream_type, max(numbers, default=0) + 1, extension)
+
+def ensure_video_extension(filename: str, extension: str = ".avi") -> str:
+    """
+    Returns the filename with a video extension, the extension is appended if the filename does not have one.
+
+    Parameters:
+        filename (str): The filename of the video.
+        extension (str): The extension to append.
+
+    Returns:
+        str: The filename with a video extension.
+    """
+    return filename if filename.endswith(VIDEO_EXTENSIONS) else filename + extension
+
+def get_frame_pool_size(batch_size: int | None = None, prefetch: int = PIPELINE_PREFETCH) -> int:
+    """
+    Returns the number of pooled frames a video source needs in process_video_threads, so that no pooled frame 
+    is decoded into again while it is still queued, processed or recorded.
+
+    The frames held at once are the read and write queues, the frame the reader is waiting to queue, 
+    the frame being decoded, the frame the writer is recording, and the frame or batch being processed.
+
+    Parameters:
+        batch_size (int | None): The number of frames passed to the callback at once, None to pass each frame on its own.
+        prefetch (int): The maximum number of frames waiting in each stage.
+
+    Returns:
+        int: The number of pooled frames.
+    """
+    return 2 * prefetch + 3 + (batch_size or 1)
+
+class FpsCounter:
+    """
+    Smooths the measured FPS with an exponential moving average, so the displayed FPS does not jitter every frame.
+
+    Attributes:
+        smoothing (float): The weight of the latest frame in the moving average.
+        interval (float): The number of seconds between each update of the displayed FPS.
+        __fps (float): The moving average of the FPS.
+        __last_time (float): The time of the previous frame, None before the first frame.
+        __last_display (float): The time the displayed FPS was last updated.
+        __display_fps (int): The displayed FPS.
+    """
+
+    def __init__(self, smoothing: float = FPS_SMOOTHING, interval: float = FPS_DISPLAY_INTERVAL) -> None:
+        """
+        The constructor for the FpsCounter class.
+
+        Parameters:
+            smoothing (float): The weight of the latest frame in the moving average.
+            interval (float): The number of seconds between each update of the displayed FPS.
+        """
+        self.smoothing = smoothing
+        self.interval = interval
+        self.__fps = 0.0
+        self.__last_time = None
+        self.__last_display = 0.0
+        self.__display_fps = 0
+
+    def update(self, frames: int = 1) -> int:
+        """
+        Records new frames.
+
+        Parameters:
+            frames (int): The number of frames processed since the last update.
+
+        Returns:
+            int: The FPS to display, only updated every interval seconds.
+        """
+        now = time.perf_counter()
+        if self.__last_time is not None:
+            # Guard against a zero frame time when the clock has not ticked between frames
+            dt = max(now - self.__last_time, 1e-6)
+            self.__fps += self.smoothing * (frames / dt - self.__fps)
+        self.__last_time = now
 
-    count = 1
-    print(path +  '/' + result + extension)
-    while os.path.exists(path +  '/' + result + extension):
-        result = stream_type + "_" + str(count)
-        count += 1
-    return result + extension
+        if now - self.__last_display >= self.interval:
+            self.__display_fps = int(self.__fps)
+            self.__last_display = now
+        return self.__display_fps
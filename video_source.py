@@ -13,14 +13,18 @@ Components:
     - Webcam: The video source for the webcam.
     - Drone: The video source for the drone.
     - PreRecorded: The video source for the pre-recorded video.
+    - PreRecordedParallel: The video source for the pre-recorded video, decoded by several threads in parallel.
 
-Note: PreRecorded is not used in the application but only for testing the behaviour recognition model.
+Note: PreRecorded and PreRecordedParallel are not used in the application but only for testing the behaviour recognition model.
 """
 import time
+import math
+import queue
+import threading
 import cv2
 import numpy as np
 from djitellopy import Tello
-from utils import HEIGHT, WIDTH
+from utils import DRONE_FPS, DRONE_HEARTBEAT_INTERVAL, DRONE_HEIGHT, DRONE_USE_OPENCL, DRONE_WIDTH, HEIGHT, WIDTH, INFERENCE_FPS, PARALLEL_DECODE_BUFFER, PARALLEL_DECODE_WORKERS
 
 
 class VideoSource():
@@ -94,6 +98,15 @@ class VideoSource():
             int: The width of the video source.
         """
         raise NotImplementedError
+
+    def get_fps(self) -> float | None:
+        """
+        Returns the rate at which the video source delivers the frames returned by next_frame.
+
+        Returns:
+            float | None: The FPS of the video source, None if it is unknown.
+        """
+        return None
     
 
 class Webcam(VideoSource):
@@ -103,6 +116,16 @@ class Webcam(VideoSource):
     Attributes:
         __cap (cv2.VideoCapture): The video capture object.
         __frame (numpy.ndarray): The current frame.
+        __skip (int): The number of frames the webcam delivers for each frame that is processed.
+        __fps (float | None): The rate at which the processed frames are delivered, None if unknown.
+        __width (int): The width of the frame.
+        __height (int): The height of the frame.
+        __latest (tuple[bool, numpy.ndarray | None]): The latest frame captured by the capture thread.
+        __captured (int): The number of frames captured by the capture thread.
+        __returned (int): The number of the last captured frame returned by next_frame.
+        __condition (threading.Condition): Signals that the capture thread has captured a frame.
+        __running (bool): Whether the capture thread should keep capturing.
+        __thread (threading.Thread): The capture thread.
     """
 
     def __init__(self) -> None:
@@ -112,6 +135,16 @@ class Webcam(VideoSource):
         super().__init__()
         self.__frame = None
         self.__has_frame = False
+        self.__skip = 1
+        self.__fps = None
+        self.__width = 0
+        self.__height = 0
+        self.__latest = (False, None)
+        self.__captured = 0
+        self.__returned = 0
+        self.__condition = threading.Condition()
+        self.__running = False
+        self.__thread = None
 
     def start(self) -> None:
         """
@@ -123,6 +156,20 @@ class Webcam(VideoSource):
         self.__cap.set(cv2.CAP_PROP_FRAME_WIDTH, WIDTH)
         self.__cap.set(cv2.CAP_PROP_FRAME_HEIGHT, HEIGHT)
 
+        # The webcam may not support the requested size, so read back the size it actually delivers
+        self.__width = int(self.__cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.__height = int(self.__cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+        # Only decode as many frames as the inference can keep up with
+        source_fps = self.__cap.get(cv2.CAP_PROP_FPS)
+        self.__skip = max(1, int(round(source_fps / INFERENCE_FPS)))
+        self.__fps = source_fps / self.__skip if source_fps > 0 else None
+
+        # Capture the next frame on its own thread while the current frame is being processed
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__capture, daemon=True)
+        self.__thread.start()
+
     def get_display_frame(self) -> tuple[bool, np.ndarray]:
         """
         Returns the current frame to be displayed on the screen.
@@ -136,16 +183,43 @@ class Webcam(VideoSource):
         """
         Callback function to get the next frame from the webcam video source.
 
+        Waits for a frame newer than the last one returned, and only returns the latest frame
+        if the capture thread has captured several in the meantime.
+
         Returns:
             tuple[bool, np.ndarray]: A tuple containing whether the frame is valid and the frame to be displayed.
         """
-        self.__has_frame, self.__frame = self.__cap.read()
+        with self.__condition:
+            self.__condition.wait_for(lambda: self.__captured != self.__returned)
+            self.__returned = self.__captured
+            self.__has_frame, self.__frame = self.__latest
         return self.__has_frame, self.__frame
+
+    def __capture(self) -> None:
+        """
+        Captures frames from the webcam until the video source is exited or the webcam stops delivering frames.
+
+        The skipped frames are only grabbed, which advances the stream without decoding them.
+        """
+        while self.__running:
+            has_frame = all(self.__cap.grab() for _ in range(self.__skip))
+            latest = self.__cap.retrieve() if has_frame else (False, None)
+
+            with self.__condition:
+                self.__latest = latest
+                self.__captured += 1
+                self.__condition.notify_all()
+
+            if not latest[0]:
+                break
     
     def exit(self) -> None:
         """
         Callback function to exit the webcam video source.
         """
+        self.__running = False
+        if self.__thread is not None:
+            self.__thread.join()
         self.__cap.release()
 
     def get_height(self) -> int:
@@ -155,7 +229,7 @@ class Webcam(VideoSource):
         Returns:
             int: The height of the webcam video source.
         """
-        return int(self.__cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        return self.__height
     
     def get_width(self) -> int:
         """
@@ -164,7 +238,16 @@ class Webcam(VideoSource):
         Returns:    
             int: The width of the webcam video source.
         """
-        return int(self.__cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        return self.__width
+
+    def get_fps(self) -> float | None:
+        """
+        Returns the rate at which the processed frames are delivered, after the skipped frames.
+
+        Returns:
+            float | None: The FPS of the webcam video source, None if the webcam does not report it.
+        """
+        return self.__fps
     
 class Drone:
     """
@@ -172,7 +255,10 @@ class Drone:
 
     Attributes:
         __drone (Tello): The drone object.
-        __frame (numpy.ndarray): The current frame.
+        __frame (numpy.ndarray): The current frame, already converted for display.
+        __use_opencl (bool): Whether the frame is converted on an OpenCL device.
+        __alive (bool): Whether the heartbeat thread should keep the drone connected.
+        __heartbeat_thread (threading.Thread): The thread that keeps the drone connected.
     """
 
     def __init__(self) -> None:
@@ -183,6 +269,9 @@ class Drone:
         self.__drone = None
         self.__frame = None
         self.__has_frame = False
+        self.__use_opencl = False
+        self.__alive = False
+        self.__heartbeat_thread = None
 
     def start(self) -> None:
         """
@@ -210,26 +299,31 @@ class Drone:
         
         self.__drone = myDrone
 
+        # Keep the drone connected from a background thread instead of once per frame
+        self.__alive = True
+        self.__heartbeat_thread = threading.Thread(target=self.__heartbeat, daemon=True)
+        self.__heartbeat_thread.start()
+
+        # Convert the frames on the GPU through OpenCV's transparent API if there is an OpenCL device
+        self.__use_opencl = DRONE_USE_OPENCL and cv2.ocl.haveOpenCL()
+        cv2.ocl.setUseOpenCL(self.__use_opencl)
+
     def get_display_frame(self) -> tuple[bool, np.ndarray]:
         """
-        Returns the current frame to be displayed on the screen.
+        Returns the current frame to be displayed on the screen, the colour is converted once in next_frame.
 
         Returns:
             tuple[bool, np.ndarray]: A tuple containing whether the frame is valid and the frame to be displayed.
         """
-        return self.__has_frame, cv2.cvtColor(self.__frame, cv2.COLOR_BGR2RGB)
+        return self.__has_frame, self.__frame
     
     def next_frame(self) -> tuple[bool, np.ndarray]:
         """
         Callback function to get the next frame from the drone video source.
 
-        Send the drone a command to confirm that the drone is still connected.
-
         Returns:
             tuple[bool, np.ndarray]: A tuple containing whether the frame is valid and the frame to be displayed.
         """
-
-        self.__drone.send_rc_control(0, 0, 0, 0)
         try:
             myFrame = self.__drone.get_frame_read()
         except:
@@ -237,17 +331,42 @@ class Drone:
             self.__has_frame = False
             return self.__has_frame, None
         
+        # Keep the native resolution of the drone camera instead of upscaling it, the tracking model 
+        # letterboxes the frame to its own input size anyway. The colour is converted once per frame, into 
+        # a new frame as it is still displayed and recorded while the next frame is read.
         myFrame = myFrame.frame
-        self.__frame = cv2.resize(myFrame, (WIDTH, HEIGHT))
+        resize = myFrame.shape[:2] != (DRONE_HEIGHT, DRONE_WIDTH)
+        if self.__use_opencl:
+            # The frame is uploaded once, converted on the device and only downloaded when it is ready
+            frame = cv2.cvtColor(cv2.UMat(myFrame), cv2.COLOR_BGR2RGB)
+            if resize:
+                frame = cv2.resize(frame, (DRONE_WIDTH, DRONE_HEIGHT), interpolation=cv2.INTER_AREA)
+            self.__frame = frame.get()
+        else:
+            self.__frame = cv2.cvtColor(myFrame, cv2.COLOR_BGR2RGB)
+            if resize:
+                self.__frame = cv2.resize(self.__frame, (DRONE_WIDTH, DRONE_HEIGHT), interpolation=cv2.INTER_AREA)
         self.__has_frame = True
         return self.__has_frame, self.__frame
 
+    def __heartbeat(self) -> None:
+        """
+        Sends the drone a command every DRONE_HEARTBEAT_INTERVAL seconds to confirm that the drone is still connected.
+        """
+        while self.__alive:
+            self.__drone.send_rc_control(0, 0, 0, 0)
+            time.sleep(DRONE_HEARTBEAT_INTERVAL)
+
     def exit(self) -> None:
         """
         Callback function to exit the drone video source.
 
         Land the drone and stop the video stream.
         """
+        self.__alive = False
+        if self.__heartbeat_thread is not None:
+            self.__heartbeat_thread.join()
+
         try:    
             self.__drone.land()
         except:
@@ -256,10 +375,13 @@ class Drone:
         self.__drone.streamoff()
     
     def get_height(self) -> int:
-        return HEIGHT
+        return DRONE_HEIGHT
     
     def get_width(self) -> int:
-        return WIDTH
+        return DRONE_WIDTH
+
+    def get_fps(self) -> float:
+        return DRONE_FPS
     
 class PreRecorded(VideoSource):
     """
@@ -268,24 +390,54 @@ class PreRecorded(VideoSource):
     Attributes:
         __cap (cv2.VideoCapture): The video capture object.
         __frame (numpy.ndarray): The current frame.
+        __target_fps (float | None): The rate at which frames are sampled from the video, None to use every frame.
+        __skip (int): The number of frames in the video for each frame that is processed.
+        __pool_size (int): The number of preallocated frames that are decoded into in turn, 0 to allocate every frame.
+        __pool (list[numpy.ndarray]): The preallocated frames.
+        __slot (int): The preallocated frame the next frame is decoded into.
+        __width (int): The width of the frame.
+        __height (int): The height of the frame.
     """
-    def __init__(self, filename: str) -> None:
+    def __init__(self, filename: str, target_fps: float | None = None, pool_size: int = 0) -> None:
         """
         The constructor for the PreRecorded class.
 
+        With a pool, each frame is decoded into the next of pool_size preallocated frames and overwritten 
+        pool_size frames later, so fewer than pool_size frames may be held at any time.
+
         Parameters:
             filename (str): The filename of the pre-recorded video.
+            target_fps (float | None): The rate at which frames are sampled from the video, None to use every frame.
+            pool_size (int): The number of preallocated frames that are decoded into in turn, 0 to allocate every frame.
         """
         super().__init__()
         self.__frame = None
         self.__has_frame = False
         self.__filename = filename
+        self.__target_fps = target_fps
+        self.__skip = 1
+        self.__pool_size = pool_size
+        self.__pool = []
+        self.__slot = 0
+        self.__width = 0
+        self.__height = 0
 
     def start(self) -> None:
         """
         Callback function to start the pre-recorded video source.
         """
         self.__cap = cv2.VideoCapture(self.__filename)
+        self.__width = int(self.__cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.__height = int(self.__cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+        # Only decode the frames that are sampled
+        source_fps = self.__cap.get(cv2.CAP_PROP_FPS)
+        if self.__target_fps is not None and source_fps > 0:
+            self.__skip = max(1, int(round(source_fps / self.__target_fps)))
+
+        shape = (self.get_height(), self.get_width(), 3)
+        self.__pool = [np.empty(shape, dtype=np.uint8) for _ in range(self.__pool_size)]
+        self.__slot = 0
 
     def get_display_frame(self) -> tuple[bool, np.ndarray]:
         """
@@ -300,10 +452,23 @@ class PreRecorded(VideoSource):
         """
         Callback function to get the next frame from the pre-recorded video source.
 
+        The skipped frames are only grabbed, which advances the video without decoding them.
+
         Returns:
             tuple[bool, np.ndarray]: A tuple containing whether the frame is valid and the frame to be displayed.
         """
-        self.__has_frame, self.__frame = self.__cap.read()
+        for _ in range(self.__skip - 1):
+            if not self.__cap.grab():
+                self.__has_frame = False
+                return self.__has_frame, None
+
+        if not self.__pool:
+            self.__has_frame, self.__frame = self.__cap.read()
+            return self.__has_frame, self.__frame
+
+        # Decode into the next preallocated frame instead of a new array
+        self.__has_frame, self.__frame = self.__cap.read(self.__pool[self.__slot])
+        self.__slot = (self.__slot + 1) % self.__pool_size
         return self.__has_frame, self.__frame
     
     def exit(self) -> None:
@@ -313,9 +478,187 @@ class PreRecorded(VideoSource):
         self.__cap.release()
 
     def get_height(self) -> int:
-        return int(self.__cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        return self.__height
+    
+    def get_width(self) -> int:
+        return self.__width
     
+    def get_fps(self) -> float | None:
+        fps = self.__cap.get(cv2.CAP_PROP_FPS)
+        return fps / self.__skip if fps > 0 else None
+
+class PreRecordedParallel(VideoSource):
+    """
+    A class used to represent the pre-recorded video source, decoded by several threads in parallel.
+
+    The video is split into one contiguous interval of frames per worker. Each worker seeks to the start of 
+    its interval with its own video capture object and decodes ahead into its own queue, and the frames 
+    are returned in order by reading the queues one after another. The queues share PARALLEL_DECODE_BUFFER 
+    frames between them, so the decoded frames held at once do not grow with the number of workers.
+
+    Attributes:
+        __filename (str): The filename of the pre-recorded video.
+        __workers (int): The maximum number of decoding threads.
+        __target_fps (float | None): The rate at which frames are sampled from the video, None to use every frame.
+        __skip (int): The number of frames in the video for each frame that is processed.
+        __fps (float | None): The rate of the processed frames, None if the video does not report it.
+        __width (int): The width of the frame.
+        __height (int): The height of the frame.
+        __queues (list[queue.Queue]): The decoded frames of each interval, in the order of the intervals.
+        __threads (list[threading.Thread]): The decoding threads.
+        __current (int): The interval whose frames are currently returned.
+        __stop (threading.Event): Set to stop the decoding threads.
+        __frame (numpy.ndarray): The current frame.
+    """
+    def __init__(self, filename: str, workers: int = PARALLEL_DECODE_WORKERS, target_fps: float | None = None) -> None:
+        """
+        The constructor for the PreRecordedParallel class.
+
+        Parameters:
+            filename (str): The filename of the pre-recorded video.
+            workers (int): The maximum number of decoding threads.
+            target_fps (float | None): The rate at which frames are sampled from the video, None to use every frame.
+        """
+        super().__init__()
+        self.__frame = None
+        self.__has_frame = False
+        self.__filename = filename
+        self.__workers = workers
+        self.__target_fps = target_fps
+        self.__skip = 1
+        self.__fps = None
+        self.__width = 0
+        self.__height = 0
+        self.__queues = []
+        self.__threads = []
+        self.__current = 0
+        self.__stop = threading.Event()
+
+    def start(self) -> None:
+        """
+        Callback function to start the pre-recorded video source.
+
+        Splits the video into intervals and starts decoding each interval on its own thread.
+        """
+        cap = cv2.VideoCapture(self.__filename)
+        source_fps = cap.get(cv2.CAP_PROP_FPS)
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.__width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.__height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        cap.release()
+
+        if self.__target_fps is not None and source_fps > 0:
+            self.__skip = max(1, int(round(source_fps / self.__target_fps)))
+        self.__fps = source_fps / self.__skip if source_fps > 0 else None
+
+        # Each interval starts on a sampled frame, the last interval runs until the video ends 
+        # in case the frame count reported by the container is short
+        if total > 0:
+            sampled = math.ceil(total / self.__skip)
+            step = math.ceil(sampled / self.__workers) * self.__skip
+            starts = list(range(0, total, step))
+        else:
+            starts = [0]
+        intervals = [(start, end) for start, end in zip(starts, starts[1:] + [None])]
+
+        self.__stop.clear()
+        self.__current = 0
+        buffer = max(1, PARALLEL_DECODE_BUFFER // len(intervals))
+        self.__queues = [queue.Queue(maxsize=buffer) for _ in intervals]
+        self.__threads = [threading.Thread(target=self.__decode, args=(start, end, out), daemon=True)
+                          for (start, end), out in zip(intervals, self.__queues)]
+        for thread in self.__threads:
+            thread.start()
+
+    def __decode(self, start: int, end: int | None, out: queue.Queue) -> None:
+        """
+        Decodes the sampled frames of an interval of the video into a queue, followed by None once the interval ends.
+
+        Parameters:
+            start (int): The index of the first frame of the interval.
+            end (int | None): The index of the frame after the interval, None to decode until the video ends.
+            out (queue.Queue): The queue the decoded frames are put on.
+        """
+        cap = cv2.VideoCapture(self.__filename)
+        try:
+            if start > 0:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+
+            index = start
+            while end is None or index < end:
+                # The skipped frames are only grabbed, which advances the video without decoding them
+                if (index - start) % self.__skip:
+                    if not cap.grab():
+                        break
+                else:
+                    has_frame, frame = cap.read()
+                    if not has_frame or not self.__put(out, frame):
+                        break
+                index += 1
+        finally:
+            cap.release()
+            self.__put(out, None)
+
+    def __put(self, out: queue.Queue, item) -> bool:
+        """
+        Puts an item on a queue, waiting for space until the video source is stopped.
+
+        Parameters:
+            out (queue.Queue): The queue.
+            item (numpy.ndarray | None): The item to be queued.
+
+        Returns:
+            bool: Whether the item was queued.
+        """
+        while not self.__stop.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get_display_frame(self) -> tuple[bool, np.ndarray]:
+        """
+        Returns the current frame to be displayed on the screen.
+
+        Returns:
+            tuple[bool, np.ndarray]: A tuple containing whether the frame is valid and the frame to be displayed.
+        """
+        return self.__has_frame, self.__frame
+
+    def next_frame(self) -> tuple[bool, np.ndarray]:
+        """
+        Callback function to get the next frame from the pre-recorded video source, in the order of the video.
+
+        Returns:
+            tuple[bool, np.ndarray]: A tuple containing whether the frame is valid and the frame to be displayed.
+        """
+        while self.__current < len(self.__queues):
+            frame = self.__queues[self.__current].get()
+            if frame is not None:
+                self.__has_frame, self.__frame = True, frame
+                return self.__has_frame, self.__frame
+
+            # The interval has ended, continue with the next one
+            self.__current += 1
+
+        self.__has_frame, self.__frame = False, None
+        return self.__has_frame, self.__frame
+
+    def exit(self) -> None:
+        """
+        Callback function to exit the pre-recorded video source.
+        """
+        self.__stop.set()
+        for thread in self.__threads:
+            thread.join()
+
+    def get_height(self) -> int:
+        return self.__height
+
     def get_width(self) -> int:
-        return int(self.__cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        return self.__width
 
-    
\ No newline at end of file
+    def get_fps(self) -> float | None:
+        return self.__fps